@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmarks the scripts against the local mock API server in MockServer.py, so no real API quota is used.
+# Usage:  python Benchmark.py dalle [--requests 1000] [--latency-ms 200] [--concurrency 10 100 500]
+#         python Benchmark.py chat | tts | startup [--repeats 5] | all
+# Add --save to keep the results for the current commit, and --compare <commit or file> to check for regressions against saved results:
+#         git checkout main && python Benchmark.py all --save
+#         git checkout my-branch && python Benchmark.py all --save --compare main
+
+# ======================================================================================================================================
+# ========================================================= USER SETTINGS ==============================================================
+# ======================================================================================================================================
+
+default_concurrency_levels = [10, 100, 500]
+default_request_count = 1000        # Total requests sent at each concurrency level
+default_latency_ms = 200            # How long the mock server waits before answering each request
+mock_image_size = (256, 256)        # Size of the image the mock server returns
+default_startup_repeats = 5         # Times each script is started for the startup benchmark. The median is shown
+chat_stream_requests = 20           # Streaming chat requests sent one after another, like a conversation
+tts_chunk_chars = 300               # Length of each piece of text in the TTS benchmark
+results_dir = "Benchmark Results"   # Saved results, one file per commit
+regression_threshold = 0.10         # A result more than this much worse than the baseline (0.10 = 10%) counts as a regression
+
+# ======================================================================================================================================
+# ======================================================================================================================================
+# ======================================================================================================================================
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import Metrics
+from MockServer import start_mock_server
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Whether a higher or lower value of each result is better, for finding regressions
+higher_is_better = {"requests_per_sec": True, "p50_ms": False, "p95_ms": False, "ttfb_p50_ms": False, "ttfb_p95_ms": False,
+                    "import_ms": False, "process_ms": False}
+
+# Returns the wall time percentiles of the API calls recorded by Metrics.py since the last time this was called.
+# For streamed replies the time to first byte is also useful, as that's when the reply starts appearing
+def take_call_latencies(include_first_byte=False):
+    with Metrics.records_lock:
+        records = list(Metrics.call_records)
+        Metrics.call_records.clear()
+    wall_times = sorted(record["wall_time"] for record in records if record["error"] is None)
+    if not wall_times:
+        return {}
+    latencies = {"p50_ms": Metrics.percentile(wall_times, 0.5) * 1000, "p95_ms": Metrics.percentile(wall_times, 0.95) * 1000}
+    first_byte_times = sorted(record["time_to_first_byte"] for record in records if record["time_to_first_byte"] is not None)
+    if include_first_byte and first_byte_times:
+        latencies["ttfb_p50_ms"] = Metrics.percentile(first_byte_times, 0.5) * 1000
+        latencies["ttfb_p95_ms"] = Metrics.percentile(first_byte_times, 0.95) * 1000
+    return latencies
+
+def format_ms(value):
+    return f"{value:>8.0f}" if value is not None else f"{'-':>8}"
+
+# Points Chat.py and TTS.py's shared client at the mock server
+def use_mock_server(mock_base_url):
+    from Common import configure_api
+    configure_api(base_url=mock_base_url)
+
+# ----------------------------------------------------- Dalle.py Benchmark -------------------------------------------------------------
+
+async def benchmark_dalle(request_count, latency_ms, concurrency_levels, mock_options):
+    import Dalle
+
+    server_process, mock_base_url = start_mock_server(latency_ms=latency_ms, image_size=mock_image_size, **mock_options)
+    temp_output_dir = tempfile.mkdtemp(prefix="dalle_benchmark_")
+    results = {}
+
+    # Remove rate limits and send everything to the mock server
+    Dalle.base_url = mock_base_url
+    Dalle.output_dir = temp_output_dir
+    Dalle.requests_per_minute = 10 ** 9
+    Dalle.images_per_minute = 10 ** 9
+
+    print(f"\nDalle.py image pipeline: {request_count} requests per run, {latency_ms} ms mock latency")
+    print(f"(Ideal throughput with zero overhead = concurrency / latency)\n")
+    print(f"  {'Concurrency':>11}  {'Time (s)':>9}  {'Requests/sec':>12}  {'Ideal':>8}  {'Efficiency':>10}  {'p50 (ms)':>8}  {'p95 (ms)':>8}")
+
+    try:
+        for concurrency in concurrency_levels:
+            Dalle.max_concurrent_requests = concurrency
+            client = Dalle.create_client("sk-benchmark", concurrency)
+            batch_jobs = [{"image_params": dict(Dalle.image_params), "base_img_filename": "Benchmark", "images_in_batch": 1}
+                          for _ in range(request_count)]
+
+            take_call_latencies()
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(open(os.devnull, "w")):  # Hide the per-image "was saved" messages
+                await Dalle.run_generation_queue(client, batch_jobs)
+            elapsed = time.perf_counter() - start_time
+            await client.close()
+
+            throughput = request_count / elapsed
+            ideal = min(concurrency, request_count) / (latency_ms / 1000)
+            latencies = take_call_latencies()
+            results[f"dalle concurrency={concurrency}"] = {"requests_per_sec": throughput, **latencies}
+            print(f"  {concurrency:>11}  {elapsed:>9.2f}  {throughput:>12.1f}  {ideal:>8.1f}  {throughput / ideal:>9.0%}  "
+                  f"{format_ms(latencies.get('p50_ms'))}  {format_ms(latencies.get('p95_ms'))}")
+    finally:
+        server_process.terminate()
+        shutil.rmtree(temp_output_dir, ignore_errors=True)
+    return results
+
+# ------------------------------------------------------ Chat.py Benchmark -------------------------------------------------------------
+
+# Measures streaming replies one at a time, as in a normal chat, and then batch mode at each concurrency level
+def benchmark_chat(request_count, latency_ms, concurrency_levels, mock_options):
+    import Chat
+
+    server_process, mock_base_url = start_mock_server(latency_ms=latency_ms, **mock_options)
+    use_mock_server(mock_base_url)
+    Chat.use_response_cache = False  # Every request has to reach the server
+    results = {}
+
+    try:
+        # Streaming, through the same function as the interactive chat
+        Chat.stream_responses = True
+        conversation = [{"role": "system", "content": Chat.systemPrompt}]
+        take_call_latencies()
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):  # Hide the streamed replies
+            for i in range(chat_stream_requests):
+                conversation = Chat.send_and_receive_message(f"Tell me about benchmark {i}.", conversation, 0.5)
+        elapsed = time.perf_counter() - start_time
+        stream_result = {"requests_per_sec": chat_stream_requests / elapsed, **take_call_latencies(include_first_byte=True)}
+        results["chat stream"] = stream_result
+
+        print(f"\nChat.py streaming: {chat_stream_requests} replies one after another, {latency_ms} ms mock latency\n")
+        print(f"  {'Requests/sec':>12}  {'First byte p50 (ms)':>19}  {'First byte p95 (ms)':>19}  {'Full reply p50 (ms)':>19}")
+        print(f"  {stream_result['requests_per_sec']:>12.2f}  {format_ms(stream_result.get('ttfb_p50_ms')):>19}  "
+              f"{format_ms(stream_result.get('ttfb_p95_ms')):>19}  {format_ms(stream_result.get('p50_ms')):>19}")
+
+        # Batch mode
+        input_path = os.path.abspath("chat_benchmark.jsonl")
+        with open(input_path, "w", encoding="utf-8") as input_file:
+            for i in range(request_count):
+                input_file.write(json.dumps({"prompt": f"Benchmark request {i}"}) + "\n")
+
+        print(f"\nChat.py batch mode: {request_count} requests per run, {latency_ms} ms mock latency\n")
+        print(f"  {'Concurrency':>11}  {'Time (s)':>9}  {'Requests/sec':>12}  {'p50 (ms)':>8}  {'p95 (ms)':>8}")
+        for concurrency in concurrency_levels:
+            output_path = os.path.abspath(f"chat_benchmark_results_{concurrency}.jsonl")
+            take_call_latencies()
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                asyncio.run(Chat.run_batch(input_path, output_path, concurrency))
+            elapsed = time.perf_counter() - start_time
+            latencies = take_call_latencies()
+            results[f"chat batch concurrency={concurrency}"] = {"requests_per_sec": request_count / elapsed, **latencies}
+            print(f"  {concurrency:>11}  {elapsed:>9.2f}  {request_count / elapsed:>12.1f}  "
+                  f"{format_ms(latencies.get('p50_ms'))}  {format_ms(latencies.get('p95_ms'))}")
+    finally:
+        server_process.terminate()
+    return results
+
+# ------------------------------------------------------- TTS.py Benchmark -------------------------------------------------------------
+
+# Measures generating the pieces of a long text at each concurrency level
+def benchmark_tts(request_count, latency_ms, concurrency_levels, mock_options):
+    import TTS
+
+    server_process, mock_base_url = start_mock_server(latency_ms=latency_ms, audio_bytes_per_char=100, **mock_options)
+    use_mock_server(mock_base_url)
+    TTS.use_audio_cache = False  # Every piece has to reach the server
+    settings = TTS.get_speech_settings()
+    chunks = [f"Piece number {i}. " + "x" * max(tts_chunk_chars - 20, 0) for i in range(request_count)]
+    results = {}
+
+    print(f"\nTTS.py long text: {request_count} pieces of {tts_chunk_chars} characters per run, {latency_ms} ms mock latency\n")
+    print(f"  {'Concurrency':>11}  {'Time (s)':>9}  {'Requests/sec':>12}  {'p50 (ms)':>8}  {'p95 (ms)':>8}")
+    try:
+        for concurrency in concurrency_levels:
+            TTS.max_concurrent_chunks = concurrency
+            take_call_latencies()
+            start_time = time.perf_counter()
+            asyncio.run(TTS.synthesize_chunks(chunks, settings, show_progress=False))
+            elapsed = time.perf_counter() - start_time
+            latencies = take_call_latencies()
+            results[f"tts concurrency={concurrency}"] = {"requests_per_sec": request_count / elapsed, **latencies}
+            print(f"  {concurrency:>11}  {elapsed:>9.2f}  {request_count / elapsed:>12.1f}  "
+                  f"{format_ms(latencies.get('p50_ms'))}  {format_ms(latencies.get('p95_ms'))}")
+    finally:
+        server_process.terminate()
+    return results
+
+# ------------------------------------------------------ Startup Benchmark -------------------------------------------------------------
+
+startup_scripts = ["Chat", "Dalle", "TTS"]
+heavy_modules = ["openai", "httpx", "aiohttp", "PIL", "tkinter"]  # Modules that should only be imported once they're needed
+
+# Starts a fresh Python process that imports the module. Returns the import time, the whole process time, and which heavy modules got loaded
+def measure_startup(module_name, work_dir):
+    import_line = f"import {module_name}" if module_name else "pass"
+    code = (f"import sys, time\nstart = time.perf_counter()\n{import_line}\n"
+            f"loaded = [name for name in {heavy_modules!r} if name in sys.modules]\n"
+            f"print('STARTUP', time.perf_counter() - start, ','.join(loaded))")
+    environment = dict(os.environ, PYTHONPATH=script_dir + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=work_dir, env=environment, capture_output=True, text=True)
+    process_time = time.perf_counter() - start_time
+    for line in result.stdout.splitlines():
+        if line.startswith("STARTUP "):
+            _, import_time, loaded = (line.split(" ") + [""])[:3]
+            return float(import_time), process_time, loaded
+    raise RuntimeError(f"Importing {module_name} failed:\n{result.stderr}")
+
+def benchmark_startup(repeats):
+    # Run from an empty folder, so the scripts' output folders aren't created next to them
+    work_dir = tempfile.mkdtemp(prefix="startup_benchmark_")
+    with open(os.path.join(work_dir, "key.txt"), "w", encoding="utf-8") as key_file:
+        key_file.write("sk-benchmark")
+    results = {}
+
+    print(f"\nScript startup time (median of {repeats} runs)\n")
+    print(f"  {'Script':<14}  {'Import (ms)':>11}  {'Process (ms)':>12}  Heavy modules loaded")
+    try:
+        for module_name in [None] + startup_scripts:
+            runs = [measure_startup(module_name, work_dir) for _ in range(repeats)]
+            import_ms = statistics.median(run[0] for run in runs) * 1000
+            process_ms = statistics.median(run[1] for run in runs) * 1000
+            loaded = runs[-1][2] or "none"
+            if module_name:
+                results[f"startup {module_name}"] = {"import_ms": import_ms, "process_ms": process_ms}
+            print(f"  {module_name or '(bare Python)':<14}  {import_ms:>11.1f}  {process_ms:>12.1f}  {loaded}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+# ---------------------------------------------------- Saving and Comparing ------------------------------------------------------------
+
+def run_git(*git_args):
+    try:
+        result = subprocess.run(["git", *git_args], cwd=script_dir, capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+# Returns the short hash of the current commit, marked '-dirty' if the scripts have uncommitted changes
+def get_commit_name():
+    commit = run_git("rev-parse", "--short", "HEAD")
+    if commit is None:
+        return "no-git"
+    return commit + ("-dirty" if run_git("status", "--porcelain", "--untracked-files=no") else "")
+
+def get_results_path(commit_name):
+    return os.path.join(script_dir, results_dir, f"{commit_name}.json")
+
+# Adds the new results to the saved results of the current commit, so targets run separately all end up in one file
+def save_results(results, run_settings):
+    commit_name = get_commit_name()
+    results_path = get_results_path(commit_name)
+    saved = {"results": {}}
+    if os.path.exists(results_path):
+        with open(results_path, "r", encoding="utf-8") as results_file:
+            saved = json.load(results_file)
+    saved["results"].update(results)
+    saved.update({"commit": commit_name, "date": datetime.datetime.now().isoformat(timespec="seconds"), "settings": run_settings})
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        json.dump(saved, results_file, indent=2)
+    print(f"\nResults saved to {results_path}")
+
+# Finds the saved results for a file path or any name git understands, such as a commit hash, branch or tag
+def load_baseline(baseline):
+    if os.path.isfile(baseline):
+        results_path = baseline
+    else:
+        commit = run_git("rev-parse", "--short", baseline)
+        results_path = get_results_path(commit or baseline)
+        if not os.path.exists(results_path) and commit and os.path.exists(get_results_path(commit + "-dirty")):
+            results_path = get_results_path(commit + "-dirty")
+    if not os.path.exists(results_path):
+        print(f"\nERROR - No saved results found for '{baseline}'. Check out that commit and run the benchmark with --save first.")
+        exit(2)
+    with open(results_path, "r", encoding="utf-8") as results_file:
+        return json.load(results_file)
+
+# Prints how each result changed from the baseline. Returns the number of regressions
+def compare_results(results, run_settings, baseline, threshold):
+    print(f"\nCompared with {baseline.get('commit', 'baseline')} ({baseline.get('date', 'unknown date')}). "
+          f"Changes worse than {threshold:.0%} are marked as regressions:\n")
+    different_settings = {name: (baseline.get("settings", {}).get(name), value) for name, value in run_settings.items()
+                          if name in baseline.get("settings", {}) and baseline["settings"][name] != value}
+    if different_settings:
+        print("  WARNING: The baseline was run with different settings, so the results may not be comparable:")
+        for name, (old_value, new_value) in different_settings.items():
+            print(f"    {name}: {old_value} -> {new_value}")
+        print()
+
+    regressions = 0
+    print(f"  {'Benchmark':<28} {'Measure':<17} {'Baseline':>10} {'Now':>10} {'Change':>8}")
+    for name, measures in results.items():
+        baseline_measures = baseline["results"].get(name)
+        if not baseline_measures:
+            continue
+        for measure, value in measures.items():
+            old_value = baseline_measures.get(measure)
+            if old_value in (None, 0) or value is None or measure not in higher_is_better:
+                continue
+            change = (value - old_value) / old_value
+            worse_by = -change if higher_is_better[measure] else change
+            marker = ""
+            if worse_by > threshold:
+                marker = "  REGRESSION"
+                regressions += 1
+            elif worse_by < -threshold:
+                marker = "  improved"
+            print(f"  {name:<28} {measure:<17} {old_value:>10.1f} {value:>10.1f} {change:>+8.0%}{marker}")
+
+    print(f"\n{regressions} regression(s) found." if regressions else "\nNo regressions found.")
+    return regressions
+
+# --------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scripts against a local mock API server.")
+    parser.add_argument("target", choices=["dalle", "chat", "tts", "startup", "all"], help="Which script's hot path to benchmark, the startup time of all of them, or everything")
+    parser.add_argument("--requests", type=int, default=default_request_count, help="Total requests per run")
+    parser.add_argument("--latency-ms", type=int, default=default_latency_ms, help="Mock server response delay in milliseconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=default_concurrency_levels, help="Concurrency levels to test")
+    parser.add_argument("--repeats", type=int, default=default_startup_repeats, help="Times each script is started for the startup benchmark")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of mock requests answered with a 429 error")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of mock requests answered with a 500 error")
+    parser.add_argument("--save", action="store_true", help=f"Save the results for the current commit in '{results_dir}'")
+    parser.add_argument("--compare", metavar="BASELINE", help="Commit, branch or results file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=regression_threshold, help="How much worse a result can be before it's a regression (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    # Checked first, so a missing baseline doesn't waste a whole benchmark run
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    # The timings are collected here instead, so don't print or save Metrics.py's own report
+    Metrics.print_summary_at_exit = False
+    Metrics.save_jsonl = Metrics.save_prometheus = False
+
+    run_settings = {"requests": args.requests, "latency_ms": args.latency_ms, "concurrency": args.concurrency, "repeats": args.repeats,
+                    "rate_limit_rate": args.rate_limit_rate, "failure_rate": args.failure_rate}
+    mock_options = {"rate_limit_rate": args.rate_limit_rate, "failure_rate": args.failure_rate, "retry_after_seconds": 0, "random_seed": 1}
+    targets = ["dalle", "chat", "tts", "startup"] if args.target == "all" else [args.target]
+    results = {}
+
+    # The scripts create their output folders where they're run, so run them in a temporary folder
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    with open(os.path.join(work_dir, "key.txt"), "w", encoding="utf-8") as key_file:
+        key_file.write("sk-benchmark")
+    os.chdir(work_dir)
+    try:
+        for target in targets:
+            if target == "dalle":
+                results.update(asyncio.run(benchmark_dalle(args.requests, args.latency_ms, args.concurrency, mock_options)))
+            elif target == "chat":
+                results.update(benchmark_chat(args.requests, args.latency_ms, args.concurrency, mock_options))
+            elif target == "tts":
+                results.update(benchmark_tts(args.requests, args.latency_ms, args.concurrency, mock_options))
+            elif target == "startup":
+                results.update(benchmark_startup(args.repeats))
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save:
+        save_results(results, run_settings)
+    if baseline and compare_results(results, run_settings, baseline, args.threshold):
+        exit(1)  # So it can be used to fail a CI job
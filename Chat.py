@@ -1,10 +1,24 @@
-from openai import OpenAI
+import re
 import json
-import tkinter as tk
 import datetime
 import os
-from tkinter import scrolledtext
 import glob
+import time
+import hashlib
+import asyncio
+import argparse
+import functools
+import threading
+import queue
+import atexit
+from Common import file_lock, create_numbered_file, remove_if_empty, configure_api, get_api_key, get_client, create_async_client, warm_up_client
+from Common import prepare_model_catalog, get_model_catalog, check_model_name, print_unknown_model_error, list_cache_files, track_cache_file
+from Metrics import measure_call, set_script_name
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None  # Token counts will be estimated instead
 
 # Some Models:
 # gpt-4
@@ -16,6 +30,55 @@ import glob
 model = "gpt-4"
 systemPrompt = "You are a helpful assistant."
 
+# Streaming prints the response as it is being generated, instead of waiting for the whole thing to finish
+stream_responses = True
+
+# Optional custom API address, such as a local test server. Leave as None to use the normal OpenAI API
+base_url = None
+
+# Response cache - Repeated requests (same model, conversation and temperature) are answered from a local cache instead of the API
+use_response_cache = True
+bypass_cache = False        # True to always send requests to the API, while still saving new responses to the cache
+cache_dir = 'Response Cache'
+cache_max_size_mb = 50      # Least recently used responses are deleted once the cache grows past this size
+cache_ttl_hours = 168       # Cached responses older than this are not used. Set to None to never expire
+
+# Context management - Only the most recent part of the conversation that fits in the token budget is sent with each message,
+# so long chats don't keep getting slower and more expensive until they hit the model's limit. Uses tiktoken for exact counts if installed
+context_token_budget = 6000       # Max tokens of conversation sent with each message. None to always send everything
+context_strategy = "window"       # "window" (leave out the oldest messages) or "summarize" (replace the oldest messages with a summary)
+summary_model = "gpt-3.5-turbo"   # Model used to write the summary for the "summarize" strategy
+
+# Saved chats - All saved conversations are kept in one log file, so saving only writes the messages added since the last save.
+# Chats saved as separate files by older versions can still be loaded by name, and are imported into the log the first time
+load_recent_only = True     # True to only read the newest messages that fit in context_token_budget when loading. Older ones stay saved
+
+# Model comparison - The 'compare' command sends the same message to several models at once and shows every answer with its speed and cost.
+# The 'race' command does the same but keeps only the first answer to arrive, which cuts waiting time when one model is slow
+compare_models = ["gpt-4", "gpt-3.5-turbo"]   # Models used when none are entered
+
+# Prices in US dollars per 1 million tokens as (input, output), used to show the cost of each answer. Models not listed show no cost.
+# Dated model versions (e.g. 'gpt-4o-2024-08-06') use the price of the longest matching name
+model_prices = {
+    "gpt-4": (30.00, 60.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# Chat logs - Logs are written to disk by a background thread, so writing them never slows down the chat
+log_flush_interval = 0.5        # Seconds between writes to the log files. Lower it to see new log entries on disk sooner
+log_fsync_policy = "interval"   # "always" (safest, slowest), "interval" (at most once every log_fsync_interval seconds) or "never" (left to the OS)
+log_fsync_interval = 5
+structured_log = False          # True to also write a JSON lines log with the model, latency and token usage of every request, for analyzing later
+
+# Batch mode - Run with:  python Chat.py --batch input.jsonl
+# Each line of the input file is a JSON object with either "prompt" (a single user message) or "messages" (a full conversation),
+# and optionally "model", "temperature" and "system". Results are written as JSON lines in the order they finish.
+# Each run writes to a new numbered file (input_results.jsonl, input_results_2.jsonl...), unless a file is given with --output, which is overwritten
+batch_concurrency = 8       # Maximum number of requests in flight at once. Adjust to fit your rate limits
+
 # Create 'Chat Logs' directory if it does not exist
 if not os.path.exists('Chat Logs'):
     os.makedirs('Chat Logs')
@@ -26,21 +89,8 @@ if not os.path.exists('Saved Chats'):
 
 # ----------------------------------------------------------------------------------
 
-# Load API key from key.txt file
-def load_api_key(filename="key.txt"):
-    try:
-        with open(filename, "r", encoding='utf-8') as key_file:
-            for line in key_file:
-                stripped_line = line.strip()
-                if not stripped_line.startswith('#') and stripped_line != '':
-                    api_key = stripped_line
-                    break
-        return api_key
-    except FileNotFoundError:
-        print("\nAPI key file not found. Please create a file named 'key.txt' in the same directory as this script and paste your API key in it.\n")
-        exit()
-
-client = OpenAI(api_key=load_api_key())  # Retrieves key from key.txt file  
+configure_api(base_url=base_url)  # The client itself is only created when first needed, see Common.py
+set_script_name("chat")  # Label for the API call timings recorded by Metrics.py
 
 # Generate the filename only once when the script starts
 timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -51,32 +101,337 @@ def send_and_receive_message(userMessage, messagesTemp, temperature=0.5):
     messagesTemp.append({"role": "user", "content": userMessage})
 
     # Log the user's message before the API call
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        indented_user_message = f"{messagesTemp[-1]['content']}".replace('\n', '\n    ')
-        log_file.write(f"{messagesTemp[-1]['role'].capitalize()}:\n\n    {indented_user_message}\n\n")  # Extra '\n' for blank line
+    write_log_entry(messagesTemp[-1]['role'], messagesTemp[-1]['content'])
+
+    # Only send as much of the conversation as fits in the token budget
+    requestMessages = build_request_messages(messagesTemp)
+    prompt_tokens = sum(get_message_tokens(message) for message in requestMessages)
+    prompt_tokens_estimated = True
+    start_time = time.perf_counter()
+    time_to_first_token = None
+    usage = None
+
+    # Check the cache first, and only call the API if there is no saved response for this exact request
+    cache_key = get_cache_key(model, requestMessages, temperature)
+    cachedResponse = load_cached_response(cache_key)
+    if cachedResponse:
+        chatResponseRole = cachedResponse["role"]
+        chatResponseMessage = cachedResponse["content"]
+        print("\n" + chatResponseMessage)
+        write_log_entry(chatResponseRole, chatResponseMessage)
 
     # Call the OpenAI API
-    chatResponse = client.chat.completions.create(
-        model=model,
-        messages=messagesTemp,
-        temperature=temperature
-    )
-    chatResponseData = chatResponse.choices[0].model_dump()["message"]
-    chatResponseMessage = chatResponseData["content"]
-    chatResponseRole = chatResponseData["role"]
-
-    print("\n" + chatResponseMessage)
+    elif stream_responses:
+        with measure_call("chat.completions", model) as call:
+            chatResponseRole, chatResponseMessage, time_to_first_token, usage = stream_chat_response(requestMessages, temperature)
+            call.set_usage(usage)
+    else:
+        with measure_call("chat.completions", model) as call:
+            chatResponse = get_client().chat.completions.create(
+                model=model,
+                messages=requestMessages,
+                temperature=temperature
+            )
+            call.set_usage(chatResponse.usage)
+        chatResponseData = chatResponse.choices[0].model_dump()["message"]
+        chatResponseMessage = chatResponseData["content"]
+        chatResponseRole = chatResponseData["role"]
+        usage = chatResponse.usage
+
+        print("\n" + chatResponseMessage)
+
+        # Write the assistant's response to the log file
+        write_log_entry(chatResponseRole, chatResponseMessage)
+
+    # Report the size of the request and how long it took
+    total_time = time.perf_counter() - start_time
+    if usage:
+        prompt_tokens = usage.prompt_tokens
+        prompt_tokens_estimated = False
+    report = [f"Prompt tokens: {'~' if prompt_tokens_estimated else ''}{prompt_tokens}"]
+    if len(requestMessages) < len(messagesTemp):
+        report.append(f"Messages sent: {len(requestMessages)} of {len(messagesTemp)}")
+    if cachedResponse:
+        report.append("Cached response")
+    else:
+        if time_to_first_token is not None:
+            report.append(f"Time to first token: {time_to_first_token:.2f}s")
+        report.append(f"Total time: {total_time:.2f}s")
+    print(f"\n[{' | '.join(report)}]")
+    write_request_record(mode="chat", model=model, temperature=temperature, cached=bool(cachedResponse),
+                         messages_sent=len(requestMessages), prompt_tokens=prompt_tokens, prompt_tokens_estimated=prompt_tokens_estimated,
+                         completion_tokens=usage.completion_tokens if usage else None,
+                         time_to_first_token=round(time_to_first_token, 3) if time_to_first_token is not None else None,
+                         latency=round(total_time, 3))
+
+    if not cachedResponse:
+        store_cached_response(cache_key, chatResponseRole, chatResponseMessage)
 
     # Append chatbot response to full conversation dictionary
     messagesTemp.append({"role": chatResponseRole, "content": chatResponseMessage})
 
-    # Write the assistant's response to the log file
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        indented_response = f"{messagesTemp[-1]['content']}".replace('\n', '\n    ')
-        log_file.write(f"{messagesTemp[-1]['role'].capitalize()}:\n\n    {indented_response}\n\n")  # Indent assistant entries
-
     return messagesTemp
 
+# ---------------------------------------------- Context Management --------------------------------------------
+
+conversation_summary = {"covered": 0, "content": ""}  # Summary of the first 'covered' messages after the system prompt, for the "summarize" strategy
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoding(modelName):
+    try:
+        return tiktoken.encoding_for_model(modelName)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+# Counts the tokens used by one message. Results are cached, so each message is only ever counted once
+@functools.lru_cache(maxsize=4096)
+def count_message_tokens(content, modelName):
+    message_overhead = 4  # Each message uses a few extra tokens for the role and formatting
+    if tiktoken is None:
+        return len(content) // 4 + message_overhead  # Roughly 4 characters per token for English text
+    return len(get_token_encoding(modelName).encode(content)) + message_overhead
+
+def get_message_tokens(message):
+    return count_message_tokens(message["content"], model)
+
+# Writes a short summary of the given messages, continuing on from any earlier summary
+def summarize_messages(previous_summary, messagesToSummarize):
+    transcript = "\n\n".join(f"{message['role'].capitalize()}: {message['content']}" for message in messagesToSummarize)
+    if previous_summary:
+        transcript = f"Summary of the conversation before this:\n{previous_summary}\n\n{transcript}"
+    with measure_call("chat.completions (summary)", summary_model) as call:
+        summaryResponse = get_client().chat.completions.create(
+            model=summary_model,
+            messages=[{"role": "system", "content": "Summarize the following conversation concisely, keeping all facts, decisions and details that may be needed later."},
+                      {"role": "user", "content": transcript}],
+            temperature=0
+        )
+        call.set_usage(summaryResponse.usage)
+    return summaryResponse.choices[0].message.content
+
+# Returns the messages to actually send: the system prompt, plus as many of the most recent messages as fit within context_token_budget.
+# With the "summarize" strategy, messages that no longer fit are replaced by a summary. The full history in messagesTemp is never changed
+def build_request_messages(messagesTemp):
+    if context_token_budget is None:
+        return messagesTemp
+    head = messagesTemp[:1] if messagesTemp and messagesTemp[0]["role"] == "system" else []
+    history = messagesTemp[len(head):]
+
+    def get_summary_message():
+        if context_strategy == "summarize" and conversation_summary["content"]:
+            return [{"role": "system", "content": f"Summary of the earlier conversation: {conversation_summary['content']}"}]
+        return []
+
+    # Goes back from the newest message until the budget is used up. The newest message is always included
+    def find_window_start(used_tokens):
+        start = len(history)
+        while start > 0:
+            message_tokens = get_message_tokens(history[start - 1])
+            if start < len(history) and used_tokens + message_tokens > context_token_budget:
+                break
+            used_tokens += message_tokens
+            start -= 1
+        return start
+
+    fixed_messages = head + get_summary_message()
+    start = find_window_start(sum(get_message_tokens(message) for message in fixed_messages))
+
+    # Summarize any messages that just fell out of the window, then fit the window again around the new summary.
+    # A longer summary can push more messages out of the window, so repeat until every message is in either the summary or the window
+    while context_strategy == "summarize" and start > conversation_summary["covered"]:
+        print(f"\n(Summarizing {start - conversation_summary['covered']} older message(s) to stay within the context budget...)")
+        conversation_summary["content"] = summarize_messages(conversation_summary["content"], history[conversation_summary["covered"]:start])
+        conversation_summary["covered"] = start
+        fixed_messages = head + get_summary_message()
+        start = max(start, find_window_start(sum(get_message_tokens(message) for message in fixed_messages)))
+
+    return fixed_messages + history[start:]
+
+def reset_conversation_summary():
+    conversation_summary["covered"] = 0
+    conversation_summary["content"] = ""
+
+# --------------------------------------------------------------------------------------------------------------
+
+# Writes text to a file from a background thread. Text waits in a bounded queue and is written in batches every flush_interval seconds,
+# so logging never waits on the disk. If the queue fills up, write() waits for the thread to catch up instead of using more memory
+class BackgroundLogWriter:
+    def __init__(self, path, flush_interval=0.5, fsync_policy="interval", fsync_interval=5, max_queue_size=10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, text):
+        self.queue.put(text)
+
+    # Writes out everything still queued and stops the thread
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        log_file = None  # Only opened once there is something to write, so unused logs don't leave empty files
+        last_fsync = time.monotonic()
+        stopping = False
+        while not stopping:
+            # Wait for the first piece of text, then collect everything else that arrives within the flush interval
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            if not batch:
+                continue
+
+            if log_file is None:
+                log_file = open(self.path, 'a', encoding='utf-8')
+            log_file.write("".join(batch))
+            log_file.flush()
+            if self.fsync_policy == "always" or (self.fsync_policy == "interval" and (stopping or time.monotonic() - last_fsync >= self.fsync_interval)):
+                os.fsync(log_file.fileno())
+                last_fsync = time.monotonic()
+        if log_file is not None:
+            log_file.close()
+
+log_writer = BackgroundLogWriter(log_file_path, log_flush_interval, log_fsync_policy, log_fsync_interval)
+atexit.register(log_writer.close)
+structured_log_writer = None
+if structured_log:
+    structured_log_writer = BackgroundLogWriter(os.path.splitext(log_file_path)[0] + '.jsonl', log_flush_interval, log_fsync_policy, log_fsync_interval)
+    atexit.register(structured_log_writer.close)
+
+# Writes a message to the log file, indenting the content under the role name
+def write_log_entry(role, content):
+    indented_content = f"{content}".replace('\n', '\n    ')
+    log_writer.write(f"{role.capitalize()}:\n\n    {indented_content}\n\n")  # Extra '\n' for blank line
+
+# Adds one line to the structured log describing a finished request, if structured_log is on
+def write_request_record(**fields):
+    if structured_log_writer is not None:
+        record = {"time": datetime.datetime.now().isoformat(timespec='milliseconds'), **fields}
+        structured_log_writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+# ----------------------------------------------- Response Cache -----------------------------------------------
+
+cache_stats = {"hits": 0, "misses": 0}
+
+# Creates a hash of everything that affects the response, so identical requests always get the same key
+def get_cache_key(modelName, messagesTemp, temperature):
+    key_data = json.dumps({"model": modelName, "messages": messagesTemp, "temperature": float(temperature)},
+                          sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+def get_cache_path(cache_key):
+    # Files are split into sub-folders by the first two characters of the hash to keep folders small
+    return os.path.join(cache_dir, cache_key[:2], f"{cache_key}.json")
+
+def load_cached_response(cache_key):
+    if not use_response_cache or bypass_cache:
+        return None
+    cache_path = get_cache_path(cache_key)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as cache_file:
+            cachedResponse = json.load(cache_file)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        cache_stats["misses"] += 1
+        return None
+
+    # Ignore and delete expired entries
+    if cache_ttl_hours is not None and time.time() - cachedResponse["created"] > cache_ttl_hours * 3600:
+        remove_cache_file(cache_path)
+        cache_stats["misses"] += 1
+        return None
+
+    # Update the file's modified time, which is used to find the least recently used entries when evicting
+    os.utime(cache_path)
+    cache_stats["hits"] += 1
+    return cachedResponse
+
+def store_cached_response(cache_key, role, content):
+    if not use_response_cache:
+        return
+    cache_path = get_cache_path(cache_key)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Write to a temporary file first, so a crash can never leave a half-written cache entry
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as cache_file:
+        json.dump({"created": time.time(), "role": role, "content": content}, cache_file, ensure_ascii=False)
+    os.replace(temp_path, cache_path)
+    track_cache_file(cache_dir, cache_path, cache_max_size_mb * 1024 * 1024)
+
+def remove_cache_file(cache_path):
+    try:
+        os.remove(cache_path)
+    except FileNotFoundError:
+        pass
+
+def show_cache_stats():
+    total_lookups = cache_stats["hits"] + cache_stats["misses"]
+    hit_rate = (cache_stats["hits"] / total_lookups * 100) if total_lookups else 0
+    cache_files = list_cache_files(cache_dir)
+    total_size_mb = sum(size for _, size, _ in cache_files) / (1024 * 1024)
+
+    status = "OFF" if not use_response_cache else ("BYPASSED" if bypass_cache else "ON")
+    print(f"\nResponse cache: {status}")
+    print(f"  Hits this session:   {cache_stats['hits']}")
+    print(f"  Misses this session: {cache_stats['misses']}")
+    print(f"  Hit rate:            {hit_rate:.1f}%")
+    print(f"  Cached responses:    {len(cache_files)} ({total_size_mb:.2f} MB of {cache_max_size_mb} MB max)")
+    return ""
+
+# --------------------------------------------------------------------------------------------------------------
+
+# Streams the response, printing and logging each piece as it arrives. Returns the role and the full re-assembled message
+def stream_chat_response(messagesTemp, temperature):
+    start_time = time.perf_counter()
+    time_to_first_token = None
+    chatResponseRole = "assistant"
+    message_parts = []
+    usage = None
+
+    stream = get_client().chat.completions.create(
+        model=model,
+        messages=messagesTemp,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True}  # The last chunk then has the token usage
+    )
+
+    print()
+    log_writer.write(f"{chatResponseRole.capitalize()}:\n\n    ")
+    for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.role:
+            chatResponseRole = delta.role
+        if delta.content:
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start_time
+            message_parts.append(delta.content)
+            print(delta.content, end="", flush=True)
+            log_writer.write(delta.content.replace('\n', '\n    '))
+    log_writer.write("\n\n")  # Extra '\n' for blank line
+
+    print()
+    if time_to_first_token is None:
+        time_to_first_token = time.perf_counter() - start_time
+
+    return chatResponseRole, "".join(message_parts), time_to_first_token, usage
+
 def check_special_input(text):
     if text == "file":
         text = get_text_from_file()
@@ -94,6 +449,12 @@ def check_special_input(text):
         text = get_multiline_input()
     elif text == "models":
         text = get_available_models()
+    elif text == "cache":
+        text = show_cache_stats()
+    elif text == "compare":
+        text = compare_models_command()
+    elif text == "race":
+        text = compare_models_command(race=True)
     elif text == "exit":
         exit_script()
     return text
@@ -108,23 +469,86 @@ def get_text_from_file():
 def clear_conversation_history():
     global messages
     messages = [{"role": "system", "content": systemPrompt}]
+    reset_conversation_summary()
+    reset_saved_session()
     print("\nConversation history cleared.")
     return ""
 
+# ----------------------------------------------- Saved Chats ------------------------------------------------
+# All saved conversations are kept in one append-only log file, one JSON line per message. Each line stores the offset of the message
+# before it, so a conversation is a chain that can be read backwards from its newest message. A small index file maps each saved name
+# to the offsets of its first and newest messages. Saving only appends the messages added since the last save, and saving under a new
+# name continues the same chain instead of copying the earlier messages.
+
+session_log_path = os.path.join('Saved Chats', 'Sessions.jsonl')
+session_index_path = os.path.join('Saved Chats', 'Sessions.index.json')
+saved_session = {"first": None, "last": None, "saved_count": 0, "total": 0}  # Which part of 'messages' is already in the log
+
+def reset_saved_session():
+    saved_session.update({"first": None, "last": None, "saved_count": 0, "total": 0})
+
+# Names are matched without a '.txt' extension, so 'chat' and 'chat.txt' refer to the same saved conversation
+def get_session_name(filename):
+    name, file_extension = os.path.splitext(filename.strip())
+    return name if file_extension.lower() == '.txt' else filename.strip()
+
+def read_session_index():
+    try:
+        with open(session_index_path, "r", encoding="utf-8") as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+def write_session_index(sessionIndex):
+    # Write to a temporary file first, so the index is never left half-written
+    temp_path = f"{session_index_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as index_file:
+        json.dump(sessionIndex, index_file, ensure_ascii=False)
+    os.replace(temp_path, session_index_path)
+
+# Appends messages to the end of the log, each linked to the one before it. Returns the offset of each new line.
+# Must be called while holding the log's lock, so the end of the file doesn't move while the offsets are worked out
+def append_session_messages(newMessages, prev_offset):
+    offsets = []
+    with open(session_log_path, "ab") as log_file:
+        offset = log_file.seek(0, os.SEEK_END)
+        for message in newMessages:
+            line = json.dumps({"role": message["role"], "content": message["content"], "prev": prev_offset}, ensure_ascii=False) + "\n"
+            line = line.encode("utf-8")
+            log_file.write(line)
+            offsets.append(offset)
+            prev_offset = offset
+            offset += len(line)
+        log_file.flush()
+        os.fsync(log_file.fileno())
+    return offsets
+
+def read_session_message(log_file, offset):
+    log_file.seek(offset)
+    return json.loads(log_file.readline())
+
 def save_conversation_history():
     filename = input("\nEnter the file name to save the conversation: ")
-    # Check if the filename has an extension. If not, add '.txt'
-    filename_without_ext, file_extension = os.path.splitext(filename)
-    if file_extension == '':
-        filename += '.txt'
-    save_path = os.path.join('Saved Chats', filename)
-    with open(save_path, "w", encoding="utf-8") as outfile:
-        json.dump(messages, outfile, ensure_ascii=False, indent=4)
-    print(f"\nConversation history saved to {save_path}.")
+    name = get_session_name(filename)
+    newMessages = messages[saved_session["saved_count"]:]
+
+    with file_lock(session_log_path + ".lock"):
+        offsets = append_session_messages(newMessages, saved_session["last"]) if newMessages else []
+        if offsets:
+            saved_session["first"] = saved_session["first"] if saved_session["first"] is not None else offsets[0]
+            saved_session["last"] = offsets[-1]
+        saved_session["saved_count"] = len(messages)
+        saved_session["total"] += len(newMessages)
+
+        sessionIndex = read_session_index()
+        sessionIndex[name] = {"first": saved_session["first"], "last": saved_session["last"], "count": saved_session["total"]}
+        write_session_index(sessionIndex)
+
+    print(f"\nConversation history saved as '{name}' ({len(newMessages)} new message(s) written to {session_log_path}).")
     return ""
 
-def load_conversation_history():
-    filename = input("\nEnter the file name to load the conversation: ")
+# Finds a chat saved as a JSON file by older versions of this script, and copies it into the log. Returns its index entry, or None if not found
+def import_legacy_chat(filename, name):
     filename_without_ext, file_extension = os.path.splitext(filename)
     load_path = os.path.join('Saved Chats', filename)
 
@@ -142,35 +566,194 @@ def load_conversation_history():
                     load_path = potential_files[0]
                 elif len(potential_files) > 1:
                     print(f"\nERROR: Multiple files with the name '{filename}' found with different extensions. Please specify the full exact filename, including extension.")
-                    return ""
+                    return None
 
-    global messages
     try:
         with open(load_path, "r", encoding="utf-8") as infile:
-            messages = json.load(infile)
-        print(f"\nConversation history loaded from {load_path}.")
+            legacyMessages = json.load(infile)
     except FileNotFoundError:
         print(f"\nERROR: File '{filename}' not found. Please make sure the file exists in the 'Saved Chats' folder.")
+        return None
     except json.decoder.JSONDecodeError:
         print(f"\nERROR: File '{filename}' is not a valid JSON file. Did you try to load a file that was not saved using the 'save' command? Note: The automatically generated log files cannot be loaded.")
+        return None
+    if not legacyMessages:
+        print(f"\nERROR: File '{filename}' does not contain any messages.")
+        return None
+
+    with file_lock(session_log_path + ".lock"):
+        offsets = append_session_messages(legacyMessages, None)
+        sessionIndex = read_session_index()
+        sessionIndex[name] = {"first": offsets[0], "last": offsets[-1], "count": len(offsets)}
+        write_session_index(sessionIndex)
+    print(f"\nImported {load_path} into {session_log_path}.")
+    return sessionIndex[name]
+
+def load_conversation_history():
+    filename = input("\nEnter the file name to load the conversation: ")
+    name = get_session_name(filename)
+    sessionEntry = read_session_index().get(name) or import_legacy_chat(filename.strip(), name)
+    if sessionEntry is None:
+        return ""
+
+    # Read backwards from the newest message. With load_recent_only, stop once the context budget is full, leaving older messages on disk
+    with open(session_log_path, "rb") as log_file:
+        firstMessage = read_session_message(log_file, sessionEntry["first"])
+        recentMessages = []
+        used_tokens = count_message_tokens(firstMessage["content"], model)
+        offset = sessionEntry["last"]
+        while offset != sessionEntry["first"]:
+            record = read_session_message(log_file, offset)
+            message_tokens = count_message_tokens(record["content"], model)
+            if load_recent_only and context_token_budget is not None and recentMessages and used_tokens + message_tokens > context_token_budget:
+                break
+            recentMessages.append({"role": record["role"], "content": record["content"]})
+            used_tokens += message_tokens
+            offset = record["prev"]
+
+    global messages
+    messages = [{"role": firstMessage["role"], "content": firstMessage["content"]}] + recentMessages[::-1]
+    saved_session.update({"first": sessionEntry["first"], "last": sessionEntry["last"], "saved_count": len(messages), "total": sessionEntry["count"]})
+    reset_conversation_summary()
+    print(f"\nConversation history '{name}' loaded.")
+    if len(messages) < sessionEntry["count"]:
+        print(f"(Loaded the newest {len(messages)} of {sessionEntry['count']} messages. The older ones stay saved and are kept when you save again.)")
+    return ""
+
+# ----------------------------------------------- Model Comparison -------------------------------------------------
+
+# Returns the cost in US dollars of a request, or None if the model's price isn't in model_prices
+def get_request_cost(modelName, prompt_tokens, completion_tokens):
+    matching_names = [name for name in model_prices if modelName == name or modelName.startswith(name + "-")]
+    if not matching_names:
+        return None
+    input_price, output_price = model_prices[max(matching_names, key=len)]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+# Sends the same messages to every model at once and prints each answer as soon as it arrives. In race mode, the remaining requests are
+# cancelled once the first answer arrives. Returns the answers in the order they arrived
+async def fan_out_request(modelNames, requestMessages, temperature, race=False):
+    async_client = create_async_client(concurrency=len(modelNames))
+    start_time = time.perf_counter()
+
+    async def ask_model(modelName):
+        cache_key = get_cache_key(modelName, requestMessages, temperature)
+        cachedResponse = load_cached_response(cache_key)
+        if cachedResponse:
+            return {"model": modelName, "role": cachedResponse["role"], "content": cachedResponse["content"], "cached": True}
+        try:
+            with measure_call("chat.completions (compare)", modelName) as call:
+                chatResponse = await async_client.chat.completions.create(
+                    model=modelName,
+                    messages=requestMessages,
+                    temperature=temperature
+                )
+                call.set_usage(chatResponse.usage)
+        except Exception as e:
+            return {"model": modelName, "error": f"{type(e).__name__}: {e}", "latency": time.perf_counter() - start_time}
+        responseMessage = chatResponse.choices[0].message
+        store_cached_response(cache_key, responseMessage.role, responseMessage.content)
+        result = {"model": modelName, "role": responseMessage.role, "content": responseMessage.content, "cached": False,
+                  "latency": time.perf_counter() - start_time}
+        if chatResponse.usage:
+            result["prompt_tokens"] = chatResponse.usage.prompt_tokens
+            result["completion_tokens"] = chatResponse.usage.completion_tokens
+        return result
+
+    tasks = [asyncio.create_task(ask_model(modelName)) for modelName in modelNames]
+    answers = []
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if "error" in result:
+                print(f"\n=== {result['model']} failed after {result['latency']:.2f}s ===\n{result['error']}")
+                write_request_record(mode="race" if race else "compare", model=result["model"], error=result["error"].split(":")[0],
+                                     latency=round(result["latency"], 3))
+                continue
+
+            answers.append(result)
+            print(f"\n=== [{len(answers)}] {result['model']} ===\n")
+            print(result["content"])
+            if result["cached"]:
+                print("\n[Cached response]")
+            else:
+                report = [f"Latency: {result['latency']:.2f}s"]
+                if "completion_tokens" in result:
+                    report.append(f"Tokens/sec: {result['completion_tokens'] / result['latency']:.1f}")
+                    cost = get_request_cost(result["model"], result["prompt_tokens"], result["completion_tokens"])
+                    if cost is not None:
+                        report.append(f"Cost: ${cost:.5f}")
+                print(f"\n[{' | '.join(report)}]")
+                write_request_record(mode="race" if race else "compare", model=result["model"], temperature=temperature, cached=False,
+                                     prompt_tokens=result.get("prompt_tokens"), completion_tokens=result.get("completion_tokens"),
+                                     latency=round(result["latency"], 3))
+            if race:
+                break
+    finally:
+        # Cancel anything still running (race mode, or the user pressed Ctrl+C) and wait for the cancellations to finish
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await async_client.close()
+
+    if race and len(modelNames) > 1 and answers:
+        print(f"\n(Kept the fastest answer, from {answers[0]['model']}. The other requests were cancelled.)")
+    return answers
+
+def compare_models_command(race=False):
+    modelNames = input(f"\nModels to send to, separated by commas (press Enter for {', '.join(compare_models)}): ")
+    modelNames = [modelName.strip() for modelName in modelNames.split(",") if modelName.strip()] or compare_models
+    for modelName in modelNames:
+        is_known, similar_names = check_model_name(get_client(), modelName)
+        if not is_known:
+            print_unknown_model_error(modelName, similar_names)
+            return ""
+    userMessage = input("\nEnter the message to send to all of them: ")
+    if not userMessage:
+        return ""
+    print("----------------------------------------------------------------------------------------------------")
+
+    requestMessages = build_request_messages(messages + [{"role": "user", "content": userMessage}])
+    answers = asyncio.run(fan_out_request(modelNames, requestMessages, temperature, race))
+    if not answers:
+        return ""
+
+    # Add the chosen answer to the conversation, as if it was a normal reply
+    if race:
+        chosenAnswer = answers[0]
+    else:
+        choice = input("\nEnter the number of the answer to keep in the conversation (press Enter to keep none): ")
+        if not choice.strip().isdigit() or not 1 <= int(choice) <= len(answers):
+            print("\nNo answer kept. The conversation is unchanged.")
+            return ""
+        chosenAnswer = answers[int(choice) - 1]
+    for role, content in (("user", userMessage), (chosenAnswer["role"], chosenAnswer["content"])):
+        messages.append({"role": role, "content": content})
+        write_log_entry(role, content)
+    print(f"\nAnswer from {chosenAnswer['model']} added to the conversation.")
     return ""
 
 def switch_model():
     global model
-    new_model = input("\nEnter the new model name (e.g., 'gpt-4', 'gpt-3', etc.): ")
+    new_model = input("\nEnter the new model name (e.g., 'gpt-4', 'gpt-3', etc.): ").strip()
+    # Check the name first, so a typo doesn't turn into a failed request later
+    is_known, similar_names = check_model_name(get_client(), new_model)
+    if not is_known:
+        print_unknown_model_error(new_model, similar_names)
+        print(f"Still using {model}. Run 'models' to see the available models.")
+        return ""
     model = new_model
     print(f"\nModel switched to {model}.")
     return ""
 
 def get_available_models():
-    modelsResponse = client.models.list()
-    rawModelsList = modelsResponse.model_dump()["data"] # Returns list of dictionaries
-    # Narrow down to models where name includes 'gpt'
-    gptModelsList = [model for model in rawModelsList if 'gpt' in model["id"]]
-    # Convert to a list of model names, arrange in descending alphabetical order
-    gptModelsList = [model["id"] for model in gptModelsList]
-    gptModelsList.sort(reverse=True)
-    print("\nAvailable models:\n")
+    catalog = get_model_catalog(get_client())
+    if catalog is None:
+        return ""
+    # Narrow down to models where name includes 'gpt', arranged in descending alphabetical order
+    gptModelsList = sorted((model for model in catalog["models"] if 'gpt' in model), reverse=True)
+    catalog_age_minutes = (time.time() - catalog["fetched"]) / 60
+    print(f"\nAvailable models (list updated {catalog_age_minutes:.0f} minutes ago):\n")
     for model in gptModelsList:
         print(f"  {model}")
     return ""
@@ -188,6 +771,10 @@ def exit_script():
 
 
 def get_multiline_input():
+    # Only imported when the box is actually used, to keep startup fast
+    import tkinter as tk
+    from tkinter import scrolledtext
+
     def submit_text():
         nonlocal user_input
         user_input = text_box.get("1.0", tk.END)
@@ -218,26 +805,139 @@ def get_multiline_input():
 
     return user_input.strip()
 
+# ------------------------------------------------- Batch Mode -------------------------------------------------
+
+# Reserves a new numbered results file next to the input file, so results from earlier runs are never mixed with these ones
+def get_batch_output_path(input_path):
+    input_folder, input_name = os.path.split(os.path.splitext(input_path)[0])
+    def make_name(file_number):
+        if file_number == 1:
+            return f"{input_name}_results.jsonl"
+        return f"{input_name}_results_{file_number}.jsonl"
+    existing_pattern = re.escape(input_name) + r"_results(?:_(\d+))?\.jsonl"
+    return create_numbered_file(input_folder or ".", f"{input_name}_results.jsonl", make_name, existing_pattern)
+
+# Turns one line of the batch input file into the model, message list and temperature to use
+def parse_batch_request(line):
+    request = json.loads(line)
+    if "messages" in request:
+        requestMessages = request["messages"]
+    else:
+        requestMessages = [{"role": "system", "content": request.get("system", systemPrompt)},
+                           {"role": "user", "content": request["prompt"]}]
+    return request.get("model", model), requestMessages, request.get("temperature", temperature)
+
+async def run_batch(input_path, output_path, concurrency):
+    async_client = create_async_client(concurrency=concurrency)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    completed = {"ok": 0, "failed": 0}
+    start_time = time.perf_counter()
+
+    # Reads the input file line by line, so even huge files are never fully loaded into memory
+    async def read_requests():
+        with open(input_path, "r", encoding="utf-8") as input_file:
+            for index, line in enumerate(input_file):
+                if line.strip():
+                    await queue.put((index, line))
+        for _ in range(concurrency):
+            await queue.put(None)  # Tells each worker there is nothing left to do
+
+    async def worker(output_file):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, line = item
+            request_start = time.perf_counter()
+            try:
+                requestModel, requestMessages, requestTemperature = parse_batch_request(line)
+                cache_key = get_cache_key(requestModel, requestMessages, requestTemperature)
+                cachedResponse = load_cached_response(cache_key)
+                usage = None
+                if cachedResponse:
+                    responseContent = cachedResponse["content"]
+                else:
+                    with measure_call("chat.completions (batch)", requestModel) as call:
+                        chatResponse = await async_client.chat.completions.create(
+                            model=requestModel,
+                            messages=requestMessages,
+                            temperature=requestTemperature
+                        )
+                        call.set_usage(chatResponse.usage)
+                    responseMessage = chatResponse.choices[0].message
+                    responseContent = responseMessage.content
+                    usage = chatResponse.usage
+                    store_cached_response(cache_key, responseMessage.role, responseContent)
+                result = {"index": index, "model": requestModel, "response": responseContent,
+                          "cached": bool(cachedResponse), "latency": round(time.perf_counter() - request_start, 3)}
+                completed["ok"] += 1
+                write_request_record(mode="batch", index=index, model=requestModel, temperature=requestTemperature, cached=bool(cachedResponse),
+                                     prompt_tokens=usage.prompt_tokens if usage else None,
+                                     completion_tokens=usage.completion_tokens if usage else None, latency=result["latency"])
+            except Exception as e:
+                result = {"index": index, "error": f"{type(e).__name__}: {e}"}
+                completed["failed"] += 1
+                write_request_record(mode="batch", index=index, error=type(e).__name__, latency=round(time.perf_counter() - request_start, 3))
+
+            # Results are written as soon as each request finishes, so partial output is available during long runs
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()
+
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        await asyncio.gather(read_requests(), *(worker(output_file) for _ in range(concurrency)))
+    await async_client.close()
+
+    total_time = time.perf_counter() - start_time
+    total_requests = completed["ok"] + completed["failed"]
+    print(f"\nBatch finished: {completed['ok']} succeeded, {completed['failed']} failed in {total_time:.1f}s "
+          f"({total_requests / total_time:.2f} requests/sec). Results saved to {output_path}")
+
+# --------------------------------------------------------------------------------------------------------------
+
 messages = [{"role": "system", "content": systemPrompt}]
 temperature = 0.5
 
-# Print list of special commands and description
-print("---------------------------------------------")
-print("\nBegin the chat by typing your message and hitting Enter. Here are some special commands you can use:\n")
-print("  file:   Send the contents of a text file as your message. It will ask you for the file path of the file.")
-print("  box:    Send the contents of a multi-line text box as your message. It will open a new window with a text box.")
-print("  clear:  Clear the conversation history.")
-print("  save:   Save the conversation history to a file in 'Saved Chats' folder.")
-print("  load:   Load the conversation history from a file in 'Saved Chats' folder.")
-print("  models: List available GPT models.")
-print("  switch: Switch the model.")
-print("  temp:   Set the temperature.")
-print("  exit:   Exit the script.\n")
-
-
-while True:
-    userEnteredPrompt = input("\n >>>    ")
-    userEnteredPrompt = check_special_input(userEnteredPrompt)
-    if userEnteredPrompt:
-        print("----------------------------------------------------------------------------------------------------")
-        messages = send_and_receive_message(userEnteredPrompt, messages, temperature)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat with OpenAI models, or run a batch of requests from a JSONL file.")
+    parser.add_argument("--batch", metavar="INPUT_JSONL", help="Run every request in this JSONL file instead of starting an interactive chat")
+    parser.add_argument("--output", metavar="OUTPUT_JSONL", help="Where to write batch results, replacing the file if it exists (default: a new numbered <input>_results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=batch_concurrency, help="Maximum number of batch requests in flight at once")
+    args = parser.parse_args()
+
+    get_api_key()  # Exits straight away with a message if key.txt is missing
+
+    if args.batch:
+        output_path = args.output or get_batch_output_path(args.batch)
+        try:
+            asyncio.run(run_batch(args.batch, output_path, args.concurrency))
+        except BaseException:
+            remove_if_empty(output_path)
+            raise
+        exit()
+
+    # Get the client and the model list ready in the background while the user types their first message
+    warm_up_client(prepare_model_catalog)
+
+    # Print list of special commands and description
+    print("---------------------------------------------")
+    print("\nBegin the chat by typing your message and hitting Enter. Here are some special commands you can use:\n")
+    print("  file:   Send the contents of a text file as your message. It will ask you for the file path of the file.")
+    print("  box:    Send the contents of a multi-line text box as your message. It will open a new window with a text box.")
+    print("  clear:  Clear the conversation history.")
+    print("  save:   Save the conversation history to a file in 'Saved Chats' folder.")
+    print("  load:   Load the conversation history from a file in 'Saved Chats' folder.")
+    print("  models: List available GPT models.")
+    print("  switch: Switch the model.")
+    print("  temp:   Set the temperature.")
+    print("  cache:  Show response cache statistics.")
+    print("  compare: Send a message to several models at once and compare their answers, speed and cost.")
+    print("  race:   Send a message to several models at once and keep the first answer to arrive.")
+    print("  exit:   Exit the script.\n")
+
+
+    while True:
+        userEnteredPrompt = input("\n >>>    ")
+        userEnteredPrompt = check_special_input(userEnteredPrompt)
+        if userEnteredPrompt:
+            print("----------------------------------------------------------------------------------------------------")
+            messages = send_and_receive_message(userEnteredPrompt, messages, temperature)
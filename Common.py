@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Shared code used by Chat.py, Dalle.py and TTS.py
+
+import os
+import re
+import json
+import glob
+import time
+import difflib
+import threading
+import importlib.util
+from contextlib import contextmanager
+from Metrics import get_http_event_hooks, measure_call
+
+# ------------------------------------------------------ API Clients -------------------------------------------------------------------
+# The openai package takes most of a second to import, so it is only imported once a client is actually needed, and each script starts
+# up straight away. The normal client is created once and shared, keeping its connections open between requests.
+# Connections use HTTP/2 if the optional 'h2' package is installed.
+
+api_config = {"base_url": None, "key_file": "key.txt", "check_key_prefix": False}
+client_state = {"api_key": None, "client": None}
+client_lock = threading.Lock()
+
+# Sets where requests are sent. base_url is an optional custom API address, such as a local test server.
+# check_key_prefix checks the key looks like an OpenAI key ('sk-...'). It's skipped when base_url is set, as other servers use other keys.
+# Any shared client already created is replaced by a new one with these settings the next time it's needed
+def configure_api(base_url=None, key_file="key.txt", check_key_prefix=False):
+    with client_lock:
+        api_config["base_url"] = base_url
+        api_config["key_file"] = key_file
+        api_config["check_key_prefix"] = check_key_prefix
+        client_state["client"] = None
+
+# Load API key from key.txt file
+def load_api_key(filename="key.txt", check_prefix=False):
+    api_key = ""
+    try:
+        with open(filename, "r", encoding='utf-8') as key_file:
+            for line in key_file:
+                stripped_line = line.strip()
+                if not stripped_line.startswith('#') and stripped_line != '':
+                    api_key = stripped_line
+                    break
+    except FileNotFoundError:
+        print(f"\nAPI key file not found. Please create a file named '{filename}' in the same directory as this script and paste your API key in it.\n")
+        exit()
+
+    if api_key == "":
+        print(f"\nERROR - No API key found in {filename}. Please paste your API key in {filename} and try again.")
+        exit()
+
+    # Check if string begins with 'sk-'
+    if check_prefix and not api_key.lower().startswith('sk-'):
+        print(f"\nERROR - Invalid API key found in {filename}. Please check your API key and try again.")
+        exit()
+    return api_key
+
+# Loads the API key the first time it's needed and remembers it
+def get_api_key():
+    if client_state["api_key"] is None:
+        check_prefix = api_config["check_key_prefix"] and api_config["base_url"] is None
+        client_state["api_key"] = load_api_key(api_config["key_file"], check_prefix)
+    return client_state["api_key"]
+
+# Creates the connection pool used by a client. concurrency sets how many connections are kept open, otherwise openai's defaults are used.
+# Every request is reported to Metrics.py, which times the call it belongs to
+def create_http_client(is_async=False, concurrency=None, timeout=None, prefer_aiohttp=False):
+    import httpx
+    import openai
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency) if concurrency else openai.DEFAULT_CONNECTION_LIMITS
+    timeout = timeout or openai.DEFAULT_TIMEOUT
+    if is_async and prefer_aiohttp:
+        # aiohttp handles many concurrent connections much better than httpx's own connection pool, if httpx-aiohttp is installed
+        try:
+            from httpx_aiohttp import HttpxAiohttpClient
+            return HttpxAiohttpClient(limits=limits, timeout=timeout, follow_redirects=True, event_hooks=get_http_event_hooks(is_async=True))
+        except ImportError:
+            pass
+    http_client_class = httpx.AsyncClient if is_async else httpx.Client
+    http2 = importlib.util.find_spec("h2") is not None
+    return http_client_class(http2=http2, limits=limits, timeout=timeout, follow_redirects=True, event_hooks=get_http_event_hooks(is_async))
+
+# Returns the shared normal (not async) client, creating it on first use. Safe to call from any thread
+def get_client():
+    with client_lock:
+        if client_state["client"] is None:
+            from openai import OpenAI
+            client_state["client"] = OpenAI(api_key=get_api_key(), base_url=api_config["base_url"], http_client=create_http_client())
+        return client_state["client"]
+
+# Creates an async client. Async clients belong to the event loop they're used in, so each asyncio.run() needs its own,
+# and the caller should close it when done. max_retries=None uses openai's default number of retries
+def create_async_client(concurrency=None, max_retries=None, timeout=None, prefer_aiohttp=False, api_key=None, base_url=None):
+    import openai
+    http_client = create_http_client(is_async=True, concurrency=concurrency, timeout=timeout, prefer_aiohttp=prefer_aiohttp)
+    return openai.AsyncOpenAI(api_key=api_key or get_api_key(), base_url=base_url or api_config["base_url"],
+                              max_retries=openai.DEFAULT_MAX_RETRIES if max_retries is None else max_retries, http_client=http_client)
+
+# Imports openai and creates the shared client on a background thread, so it's ready by the time the first request is sent.
+# If given, then_call is run with the client afterwards
+def warm_up_client(then_call=None):
+    def warm_up():
+        client = get_client()
+        if then_call:
+            then_call(client)
+    threading.Thread(target=warm_up, daemon=True).start()
+
+# --------------------------------------------------- Output File Naming ---------------------------------------------------------------
+# Each output folder keeps a small counter file per kind of file name, so the next free number is found in one step instead of checking
+# every existing file. The counter is protected by a lock file, and each new file is created with O_EXCL, so several copies of a script
+# running at the same time can never get the same name.
+
+# Holds a lock file for the duration of the 'with' block, so only one process at a time can run it
+@contextmanager
+def file_lock(lock_path, timeout=10, stale_after=30):
+    start_time = time.monotonic()
+    while True:
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            break
+        except FileExistsError:
+            # A lock left behind by a process that crashed is removed once it is old enough
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue  # Released in the meantime
+            if time.monotonic() - start_time > timeout:
+                raise TimeoutError(f"Timed out waiting for lock file: {lock_path}")
+            time.sleep(0.005)
+    try:
+        yield
+    finally:
+        os.close(lock_fd)
+        os.remove(lock_path)
+
+# Finds the highest number in file names in the folder matching the regex pattern, whose first group is the number.
+# Names matching without a number count as 1. Only used once per counter, to carry on from files made before the counter existed
+def find_highest_number(folder, pattern):
+    highest_number = 0
+    compiled_pattern = re.compile(pattern)
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            match = compiled_pattern.fullmatch(entry.name)
+            if match:
+                highest_number = max(highest_number, int(match.group(1) or 1))
+    return highest_number
+
+# Reserves the next 'count' numbers from the counter and returns them as a range.
+# If the counter doesn't exist yet, it starts after the highest number found with existing_pattern (see find_highest_number)
+def allocate_numbers(folder, counter_name, count=1, existing_pattern=None):
+    counter_path = os.path.join(folder, f".{counter_name}.counter")
+    with file_lock(counter_path + ".lock"):
+        try:
+            with open(counter_path, "r", encoding="utf-8") as counter_file:
+                last_number = int(counter_file.read())
+        except (FileNotFoundError, ValueError):
+            last_number = find_highest_number(folder, existing_pattern) if existing_pattern else 0
+
+        # Write to a temporary file first, so the counter is never left half-written
+        temp_path = f"{counter_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as counter_file:
+            counter_file.write(str(last_number + count))
+        os.replace(temp_path, counter_path)
+    return range(last_number + 1, last_number + count + 1)
+
+# Creates a new empty file in the folder named by make_name(number) with the next free number, and returns its path.
+# The file is created right away so the name is reserved, and the caller then writes the real contents to it
+def create_numbered_file(folder, counter_name, make_name, existing_pattern=None):
+    os.makedirs(folder, exist_ok=True)
+    while True:
+        number = allocate_numbers(folder, counter_name, existing_pattern=existing_pattern)[0]
+        file_path = os.path.join(folder, make_name(number))
+        try:
+            os.close(os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            return file_path
+        except FileExistsError:
+            continue  # Name already taken by a file the counter didn't know about, so try the next number
+
+# Creates a new empty file in the folder named file_name, or name_2, name_3... if that name is already taken, and returns its path.
+# Like create_numbered_file the name is reserved straight away, but without a counter file, for names that are normally already unique
+def create_unique_file(folder, file_name):
+    os.makedirs(folder, exist_ok=True)
+    base_name, extension = os.path.splitext(file_name)
+    number = 1
+    while True:
+        file_path = os.path.join(folder, file_name if number == 1 else f"{base_name}_{number}{extension}")
+        try:
+            os.close(os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            return file_path
+        except FileExistsError:
+            number += 1
+
+# Deletes a file made by create_numbered_file or create_unique_file if nothing was ever written to it, such as when saving failed or was interrupted,
+# so no empty output files are left behind
+def remove_if_empty(file_path):
+    try:
+        if os.path.getsize(file_path) == 0:
+            os.remove(file_path)
+    except OSError:
+        pass
+
+# ----------------------------------------------------- File Caches --------------------------------------------------------------------
+# Chat.py's response cache and TTS.py's audio cache keep one file per entry, in sub-folders named after the first two characters of the
+# entry's hash. Each hit updates the file's modified time, so once a cache grows past its limits the least recently used files are deleted.
+
+cache_usage = {}  # Cache folder -> {"bytes": total size, "entries": file count}, counted on first use and then tracked as files are added
+
+# Returns a list of (path, size, last used time) for every file in the cache folder, skipping temporary files still being written
+def list_cache_files(cache_folder):
+    cache_files = []
+    for cache_path in glob.glob(os.path.join(cache_folder, "*", "*.*")):
+        if cache_path.endswith(".tmp"):
+            continue
+        try:
+            file_stat = os.stat(cache_path)
+            cache_files.append((cache_path, file_stat.st_size, file_stat.st_mtime))
+        except FileNotFoundError:
+            pass  # Deleted by another process in the meantime
+    return cache_files
+
+# Counts a file just written to the cache folder, and evicts old files if the cache is now over max_bytes or max_entries (None for no limit)
+def track_cache_file(cache_folder, cache_path, max_bytes, max_entries=None):
+    usage = cache_usage.get(cache_folder)
+    if usage is None:
+        cache_files = list_cache_files(cache_folder)
+        usage = cache_usage[cache_folder] = {"bytes": sum(size for _, size, _ in cache_files), "entries": len(cache_files)}
+    else:
+        usage["bytes"] += os.path.getsize(cache_path)
+        usage["entries"] += 1
+    if usage["bytes"] > max_bytes or (max_entries is not None and usage["entries"] > max_entries):
+        evict_cache_files(cache_folder, max_bytes, max_entries)
+
+# Deletes the least recently used files until the cache is back under 90% of its limits
+def evict_cache_files(cache_folder, max_bytes, max_entries=None):
+    cache_files = sorted(list_cache_files(cache_folder), key=lambda entry: entry[2])
+    usage = cache_usage[cache_folder] = {"bytes": sum(size for _, size, _ in cache_files), "entries": len(cache_files)}
+    for cache_path, size, _ in cache_files:
+        if usage["bytes"] <= max_bytes * 0.9 and (max_entries is None or usage["entries"] <= max_entries * 0.9):
+            break
+        try:
+            os.remove(cache_path)
+        except FileNotFoundError:
+            pass
+        usage["bytes"] -= size
+        usage["entries"] -= 1
+
+# ---------------------------------------------------- Model Catalog -------------------------------------------------------------------
+# The list of models available to the account is saved to a file shared by all the scripts, so model names can be checked instantly
+# without a network request. Once the saved list is older than model_catalog_ttl_hours it is still used, while a fresh copy is
+# downloaded in the background.
+
+model_catalog_path = ".model_catalog.json"
+model_catalog_ttl_hours = 24
+model_catalog_state = {"refresh_thread": None, "downloaded": False}  # 'downloaded' is True once this process has fetched a fresh copy
+
+def read_model_catalog():
+    try:
+        with open(model_catalog_path, "r", encoding="utf-8") as catalog_file:
+            return json.load(catalog_file)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+
+# Downloads the list of models and saves it. Takes a normal (not async) OpenAI client
+def download_model_catalog(client):
+    with measure_call("models.list"):
+        model_ids = sorted(model.id for model in client.models.list())
+    catalog = {"fetched": time.time(), "models": model_ids}
+    # Write to a temporary file first, so other scripts never read a half-written catalog
+    temp_path = f"{model_catalog_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as catalog_file:
+        json.dump(catalog, catalog_file)
+    os.replace(temp_path, model_catalog_path)
+    model_catalog_state["downloaded"] = True
+    return catalog
+
+def refresh_model_catalog_in_background(client):
+    refresh_thread = model_catalog_state["refresh_thread"]
+    if refresh_thread is not None and refresh_thread.is_alive():
+        return
+
+    def refresh():
+        try:
+            download_model_catalog(client)
+        except Exception:
+            pass  # Keep using the saved copy, for example when offline
+
+    model_catalog_state["refresh_thread"] = threading.Thread(target=refresh, daemon=True)
+    model_catalog_state["refresh_thread"].start()
+
+def is_model_catalog_stale(catalog):
+    return catalog is None or time.time() - catalog["fetched"] > model_catalog_ttl_hours * 3600
+
+# Starts downloading the catalog in the background if there is no up to date copy, so it is ready by the time it's needed
+def prepare_model_catalog(client):
+    if is_model_catalog_stale(read_model_catalog()):
+        refresh_model_catalog_in_background(client)
+
+# Returns the saved catalog straight away, refreshing it in the background if it is out of date.
+# Only waits for the network if there is no saved copy yet. Returns None if the catalog can't be downloaded
+def get_model_catalog(client):
+    catalog = read_model_catalog()
+    if catalog is None:
+        try:
+            return download_model_catalog(client)
+        except Exception as e:
+            print(f"\nWARNING: Could not download the list of available models: {e}")
+            return None
+    if is_model_catalog_stale(catalog):
+        refresh_model_catalog_in_background(client)
+    return catalog
+
+# Checks a model name against the catalog. Returns (is_known, similar_names). A name missing from the saved catalog is checked
+# once more against a freshly downloaded copy, in case the model is new. If the catalog isn't available at all, every name is accepted
+def check_model_name(client, model_name):
+    catalog = get_model_catalog(client)
+    if catalog is not None and model_name not in catalog["models"] and not model_catalog_state["downloaded"]:
+        try:
+            catalog = download_model_catalog(client)
+        except Exception:
+            pass
+    if catalog is None or model_name in catalog["models"]:
+        return True, []
+    return False, difflib.get_close_matches(model_name, catalog["models"], n=3, cutoff=0.5)
+
+# Prints an error for an unknown model name, with suggestions
+def print_unknown_model_error(model_name, similar_names):
+    suggestion = f" Did you mean: {', '.join(similar_names)}?" if similar_names else ""
+    print(f"\nERROR - Unknown model: '{model_name}'.{suggestion}")
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# A searchable index of every image saved by Dalle.py, kept in an SQLite database inside the image folder. Each image is stored with its
+# prompts, settings and a perceptual hash (a fingerprint of what the image looks like), so images can be found by prompt without reading
+# through Image_Log.txt, and near-duplicate images can be found even if they were saved at different sizes or formats.
+# Dalle.py adds each image to the index as soon as it is saved. Images from before the index existed can be added from the Image_Log.txt files.
+# Usage:  python ImageIndex.py import                         Adds the images listed in every Image_Log.txt in the image folder
+#         python ImageIndex.py search fluffy round creature   Finds images whose prompt or revised prompt has all these words
+#         python ImageIndex.py duplicates [--distance 3]      Lists groups of images that look nearly the same
+#         python ImageIndex.py similar some_image.png         Finds indexed images that look like this one
+
+# ======================================================================================================================================
+# ========================================================= USER SETTINGS ==============================================================
+# ======================================================================================================================================
+
+image_folder = "Image Outputs"      # Same as output_dir in Dalle.py
+index_file_name = "Image_Index.db"  # Saved inside image_folder
+search_limit = 50                   # Max images shown for a search
+duplicate_max_distance = 3          # How many of the 64 bits of the hash can differ for two images to count as near-duplicates. 0 = identical looking
+
+# ======================================================================================================================================
+# ======================================================================================================================================
+# ======================================================================================================================================
+
+import os
+import re
+import json
+import sqlite3
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+# The 64 bit hash is also stored as 4 bands of 16 bits, each with its own database index. Two hashes that differ in 3 bits or fewer
+# must have at least one band exactly the same, so similar images can be looked up without comparing against every image
+hash_band_count = 4
+
+image_extensions = ("png", "webp", "jxl", "jpg", "jpeg")
+skipped_folders = ["Thumbnails", "Run Journals"]
+
+# ------------------------------------------------------- Perceptual Hash --------------------------------------------------------------
+
+# Difference hash: shrinks the image to 9x8 grey pixels, and records for each pair of neighbouring pixels whether the left one is brighter.
+# Resizing, re-compressing or small edits barely change it. Takes an image already opened with Pillow
+def get_image_dhash(img):
+    from PIL import Image
+    pixels = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR, reducing_gap=2.0).tobytes()  # One byte per pixel
+    dhash = 0
+    for row in range(8):
+        for column in range(8):
+            dhash = (dhash << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return dhash
+
+# Hashes an image file. Returns None if it can't be read. Only imports Pillow when called, as it runs in Dalle.py's save stage
+def compute_dhash(image_path):
+    from PIL import Image
+    try:
+        with Image.open(image_path) as img:
+            img.draft("L", (64, 64))  # Lets JPEG files decode at a smaller size, which is much faster. Ignored for other formats
+            return get_image_dhash(img)
+    except (OSError, ValueError):
+        return None
+
+def hash_distance(first_hash, second_hash):
+    return bin(first_hash ^ second_hash).count("1")
+
+# Splits the hash into equal bands. Hashes within band_count - 1 bits of each other always share at least one band
+def get_hash_bands(dhash, band_count=hash_band_count):
+    band_bits = 64 // band_count
+    return [(dhash >> (band * band_bits)) & ((1 << band_bits) - 1) for band in range(band_count)]
+
+# SQLite integers are signed, so hashes with the top bit set are stored as negative numbers
+def to_stored_hash(dhash):
+    return dhash - (1 << 64) if dhash is not None and dhash >= 1 << 63 else dhash
+
+def from_stored_hash(stored_hash):
+    return stored_hash + (1 << 64) if stored_hash is not None and stored_hash < 0 else stored_hash
+
+# ------------------------------------------------------------ Database ----------------------------------------------------------------
+
+class ImageIndex:
+    # Opens the index inside the folder, creating it the first time. File paths in the index are relative to this folder
+    def __init__(self, folder=image_folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(folder, index_file_name))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")  # Adding an image is a quick append, and searches can run while Dalle.py is adding images
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        band_columns = "".join(f", band_{band} INTEGER" for band in range(hash_band_count))
+        band_indexes = "".join(f"CREATE INDEX IF NOT EXISTS images_band_{band} ON images(band_{band});\n" for band in range(hash_band_count))
+        self.connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY,
+                file_path TEXT UNIQUE NOT NULL,
+                user_prompt TEXT,
+                revised_prompt TEXT,
+                model TEXT,
+                size TEXT,
+                quality TEXT,
+                style TEXT,
+                params TEXT,
+                created TEXT,
+                dhash INTEGER{band_columns}
+            );
+            {band_indexes}
+        """)
+
+        # Full text search of the prompts, kept up to date by triggers. Some Python builds don't include it, so searches fall back to LIKE
+        try:
+            self.connection.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(user_prompt, revised_prompt, content='images', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+                    INSERT INTO images_fts(rowid, user_prompt, revised_prompt) VALUES (new.id, new.user_prompt, new.revised_prompt);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+                    INSERT INTO images_fts(images_fts, rowid, user_prompt, revised_prompt) VALUES ('delete', old.id, old.user_prompt, old.revised_prompt);
+                END;
+                CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE ON images BEGIN
+                    INSERT INTO images_fts(images_fts, rowid, user_prompt, revised_prompt) VALUES ('delete', old.id, old.user_prompt, old.revised_prompt);
+                    INSERT INTO images_fts(rowid, user_prompt, revised_prompt) VALUES (new.id, new.user_prompt, new.revised_prompt);
+                END;
+            """)
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            self.full_text_search = False
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def get_relative_path(self, file_path):
+        return os.path.relpath(file_path, self.folder).replace(os.sep, "/")
+
+    def get_full_path(self, row):
+        return os.path.join(self.folder, *row["file_path"].split("/"))
+
+    # Turns an image's details into the values of one row, in the order of the columns in add_images
+    def make_row(self, file_path, user_prompt, revised_prompt, image_params=None, dhash=None, created=None):
+        image_params = image_params or {}
+        is_dalle3 = image_params.get("model") != "dall-e-2"  # Quality and style only apply to DALLE-3
+        bands = get_hash_bands(dhash) if dhash is not None else [None] * hash_band_count
+        return (self.get_relative_path(file_path), user_prompt, revised_prompt, image_params.get("model"), image_params.get("size"),
+                image_params.get("quality") if is_dalle3 else None, image_params.get("style") if is_dalle3 else None,
+                json.dumps(image_params, ensure_ascii=False) if image_params else None,
+                created or datetime.datetime.now().isoformat(timespec="seconds"), to_stored_hash(dhash), *bands)
+
+    # Adds rows made by make_row in one transaction. Images already in the index are updated, or left alone if replace is False
+    def add_images(self, rows, replace=True):
+        columns = ["file_path", "user_prompt", "revised_prompt", "model", "size", "quality", "style", "params", "created", "dhash"]
+        columns += [f"band_{band}" for band in range(hash_band_count)]
+        if replace:
+            on_conflict = "DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        else:
+            on_conflict = "DO NOTHING"
+        with self.connection:
+            cursor = self.connection.executemany(
+                f"INSERT INTO images ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT(file_path) {on_conflict}", rows)
+        return cursor.rowcount
+
+    # Adds one image straight away, such as when Dalle.py has just saved it
+    def add_image(self, file_path, user_prompt, revised_prompt, image_params=None, dhash=None):
+        self.add_images([self.make_row(file_path, user_prompt, revised_prompt, image_params, dhash)])
+
+    # Finds images whose user-written or revised prompt contains all the words, best matches first
+    def search(self, query, limit=search_limit):
+        words = query.split()
+        if not words:
+            return []
+        if self.full_text_search:
+            # Each word is quoted, so characters with a special meaning in full text search queries are searched for as normal text
+            match_query = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+            return self.connection.execute(
+                "SELECT images.* FROM images_fts JOIN images ON images.id = images_fts.rowid "
+                "WHERE images_fts MATCH ? ORDER BY images_fts.rank LIMIT ?", (match_query, limit)).fetchall()
+        conditions = " AND ".join("(user_prompt LIKE ? OR revised_prompt LIKE ?)" for _ in words)
+        values = [value for word in words for value in (f"%{word}%", f"%{word}%")]
+        return self.connection.execute(f"SELECT * FROM images WHERE {conditions} ORDER BY id DESC LIMIT ?", (*values, limit)).fetchall()
+
+    # Returns (distance, row) for every indexed image that looks like the given hash, closest first.
+    # Up to 3 bits apart, only images sharing a hash band are checked. Any further apart needs every image to be checked
+    def find_similar(self, dhash, max_distance=duplicate_max_distance):
+        if max_distance < hash_band_count:
+            bands = get_hash_bands(dhash)
+            conditions = " OR ".join(f"band_{band} = ?" for band in range(hash_band_count))
+            candidates = self.connection.execute(f"SELECT * FROM images WHERE {conditions}", bands)
+        else:
+            candidates = self.connection.execute("SELECT * FROM images WHERE dhash IS NOT NULL")
+        matches = []
+        for row in candidates:
+            distance = hash_distance(dhash, from_stored_hash(row["dhash"]))
+            if distance <= max_distance:
+                matches.append((distance, row))
+        return sorted(matches, key=lambda match: (match[0], match[1]["id"]))
+
+    # Groups images that are within max_distance bits of each other. Returns a list of groups, each a list of rows, biggest groups first
+    def find_duplicate_groups(self, max_distance=duplicate_max_distance):
+        rows = self.connection.execute("SELECT * FROM images WHERE dhash IS NOT NULL ORDER BY id").fetchall()
+        hashes = [from_stored_hash(row["dhash"]) for row in rows]
+
+        # Splitting the hash into max_distance + 1 bands means any two matching images share at least one band exactly,
+        # so only images in the same bucket need comparing instead of every pair
+        band_count = min(max_distance + 1, 64)
+        buckets = {}
+        for i, dhash in enumerate(hashes):
+            for band, band_value in enumerate(get_hash_bands(dhash, band_count)):
+                buckets.setdefault((band, band_value), []).append(i)
+
+        # Joins matching images into groups, so A~B and B~C end up together even if A and C are a little further apart
+        group_of = list(range(len(rows)))
+
+        def find_group(i):
+            while group_of[i] != i:
+                group_of[i] = group_of[group_of[i]]
+                i = group_of[i]
+            return i
+
+        checked_pairs = set()
+        for bucket in buckets.values():
+            for position, first in enumerate(bucket):
+                for second in bucket[position + 1:]:
+                    if (first, second) in checked_pairs:
+                        continue
+                    checked_pairs.add((first, second))
+                    if hash_distance(hashes[first], hashes[second]) <= max_distance:
+                        group_of[find_group(second)] = find_group(first)
+
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(find_group(i), []).append(row)
+        return sorted((group for group in groups.values() if len(group) > 1), key=len, reverse=True)
+
+    def count_images(self):
+        return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+# ------------------------------------------------------ Image_Log.txt Import ----------------------------------------------------------
+
+# Each entry in Image_Log.txt starts with the file name on its own line, followed by tab-indented "Name:<tabs>value" lines
+log_entry_start = re.compile(rf"^(\S.*\.(?:{'|'.join(image_extensions)})):\s*$", re.IGNORECASE)
+log_field = re.compile(r"^\t (Quality|Style|Revised Prompt|User-Written Prompt):\t*(.*)$")
+
+# Reads the entries of an Image_Log.txt file. Prompts with line breaks in them continue onto the following lines
+def read_image_log(log_path):
+    entries = []
+    current_field = None
+    # Opened the same way Dalle.py writes it, so the text encoding matches
+    with open(log_path, "r", errors="replace") as log_file:
+        for line in log_file:
+            line = line.rstrip("\n")
+            entry_match = log_entry_start.match(line)
+            field_match = log_field.match(line)
+            if entry_match:
+                entries.append({"file_name": entry_match.group(1)})
+                current_field = None
+            elif field_match and entries:
+                current_field = field_match.group(1)
+                entries[-1][current_field] = field_match.group(2)
+            elif current_field:
+                entries[-1][current_field] += "\n" + line
+    for entry in entries:
+        for field in ["Quality", "Style", "Revised Prompt", "User-Written Prompt"]:
+            value = entry.get(field, "").strip()
+            entry[field] = None if value in ("", "N/A") else value
+    return entries
+
+def find_image_logs(folder):
+    log_paths = []
+    for current_folder, subfolders, file_names in os.walk(folder):
+        subfolders[:] = [name for name in subfolders if name not in skipped_folders]
+        if "Image_Log.txt" in file_names:
+            log_paths.append(os.path.join(current_folder, "Image_Log.txt"))
+    return sorted(log_paths)
+
+# Guesses the model from the file name Dalle.py gave the image, since Image_Log.txt doesn't record it
+def get_model_from_file_name(file_name):
+    if file_name.upper().startswith("DALLE3"):
+        return "dall-e-3"
+    if file_name.upper().startswith("DALLE2"):
+        return "dall-e-2"
+    return None
+
+# Adds the images listed in every Image_Log.txt in the index's folder. Images already in the index are left as they are, so this can be
+# run again at any time. Hashes are computed in several processes, since every image has to be read. Returns the counts for the report
+def import_image_logs(index):
+    counts = {"logs": 0, "added": 0, "already_indexed": 0, "missing": 0}
+    indexed_paths = {row[0] for row in index.connection.execute("SELECT file_path FROM images")}
+    new_images = []
+    for log_path in find_image_logs(index.folder):
+        counts["logs"] += 1
+        for entry in read_image_log(log_path):
+            image_path = os.path.join(os.path.dirname(log_path), entry["file_name"])
+            if index.get_relative_path(image_path) in indexed_paths:
+                counts["already_indexed"] += 1
+            elif not os.path.exists(image_path):
+                counts["missing"] += 1
+            else:
+                indexed_paths.add(index.get_relative_path(image_path))
+                new_images.append((image_path, entry))
+
+    with ProcessPoolExecutor() as process_pool:
+        hashes = process_pool.map(compute_dhash, [image_path for image_path, _ in new_images], chunksize=32)
+        rows = []
+        for (image_path, entry), dhash in zip(new_images, hashes):
+            image_params = {key: value for key, value in [("model", get_model_from_file_name(entry["file_name"])),
+                                                            ("quality", entry["Quality"]), ("style", entry["Style"])] if value}
+            created = datetime.datetime.fromtimestamp(os.path.getmtime(image_path)).isoformat(timespec="seconds")
+            rows.append(index.make_row(image_path, entry["User-Written Prompt"], entry["Revised Prompt"], image_params, dhash, created))
+    counts["added"] = len(rows)
+    index.add_images(rows, replace=False)
+    return counts
+
+# --------------------------------------------------------------------------------------------------------------------------------------
+
+def print_image_row(index, row, prefix="  "):
+    prompt_text = row["user_prompt"] or row["revised_prompt"] or ""
+    short_prompt = prompt_text if len(prompt_text) <= 80 else prompt_text[:77] + "..."
+    print(f"{prefix}{index.get_full_path(row)}")
+    print(f"{prefix}    {short_prompt.replace(chr(10), ' ')}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the images saved by Dalle.py and find near-duplicates.")
+    parser.add_argument("--dir", default=image_folder, help="Image folder containing the index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("import", help="Add the images listed in every Image_Log.txt in the image folder")
+    search_parser = commands.add_parser("search", help="Find images whose prompt contains all the given words")
+    search_parser.add_argument("words", nargs="+")
+    search_parser.add_argument("--limit", type=int, default=search_limit)
+    duplicates_parser = commands.add_parser("duplicates", help="List groups of images that look nearly the same")
+    duplicates_parser.add_argument("--distance", type=int, default=duplicate_max_distance, help="Max differing bits out of 64")
+    similar_parser = commands.add_parser("similar", help="Find indexed images that look like the given image")
+    similar_parser.add_argument("image_path")
+    similar_parser.add_argument("--distance", type=int, default=10, help="Max differing bits out of 64")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(f"\nERROR - Image folder '{args.dir}' not found.")
+        exit()
+    image_index = ImageIndex(args.dir)
+
+    if args.command == "import":
+        import_counts = import_image_logs(image_index)
+        print(f"\nRead {import_counts['logs']} Image_Log.txt file(s). Added {import_counts['added']} image(s), "
+              f"{import_counts['already_indexed']} were already indexed, {import_counts['missing']} listed image(s) no longer exist.")
+        print(f"The index now has {image_index.count_images()} image(s).")
+
+    elif args.command == "search":
+        results = image_index.search(" ".join(args.words), args.limit)
+        print(f"\n{len(results)} image(s) found{' (showing the best ' + str(args.limit) + ')' if len(results) == args.limit else ''}:\n")
+        for result_row in results:
+            print_image_row(image_index, result_row)
+
+    elif args.command == "duplicates":
+        duplicate_groups = image_index.find_duplicate_groups(args.distance)
+        print(f"\n{len(duplicate_groups)} group(s) of near-duplicate images, up to {args.distance} bit(s) apart:")
+        for group_number, group in enumerate(duplicate_groups):
+            print(f"\nGroup {group_number + 1} ({len(group)} images):")
+            for group_row in group:
+                print_image_row(image_index, group_row)
+
+    elif args.command == "similar":
+        image_hash = compute_dhash(args.image_path)
+        if image_hash is None:
+            print(f"\nERROR - Could not read the image '{args.image_path}'.")
+            exit()
+        similar_images = image_index.find_similar(image_hash, args.distance)
+        print(f"\n{len(similar_images)} similar image(s) found, up to {args.distance} bit(s) apart:\n")
+        for distance, similar_row in similar_images:
+            print_image_row(image_index, similar_row, prefix=f"  [{distance:>2}] ")
+
+    image_index.close()
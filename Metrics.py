@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Records the wall time, time to first byte, retries, bytes sent and received, token usage and error type of every API call made by
+# Chat.py, Dalle.py and TTS.py. When the script exits, a summary with percentiles is printed, and the records are saved both as
+# JSON lines (one line per call, for analyzing later) and as a Prometheus text snapshot.
+
+# ======================================================================================================================================
+# ========================================================= USER SETTINGS ==============================================================
+# ======================================================================================================================================
+
+metrics_enabled = True          # False to record nothing
+metrics_dir = "Metrics"         # Folder the JSON lines and Prometheus files are saved in
+save_jsonl = True               # Save every call as a JSON line
+save_prometheus = True          # Save a Prometheus text format snapshot with percentiles and totals
+print_summary_at_exit = True    # Print p50/p95/p99 timings for each kind of call when the script exits
+
+# ======================================================================================================================================
+# ======================================================================================================================================
+# ======================================================================================================================================
+
+import atexit
+import contextvars
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+call_records = []
+records_lock = threading.Lock()
+metrics_state = {"script": None, "exit_handler_registered": False}
+
+# The call being measured in the current thread or async task, so the HTTP hooks know which call a request belongs to
+current_call = contextvars.ContextVar("current_call", default=None)
+
+# Sets the script name used to label the records. Defaults to the name of the file that was run
+def set_script_name(script_name):
+    metrics_state["script"] = script_name
+
+class CallMetrics:
+    def __init__(self, operation, model):
+        self.operation = operation
+        self.model = model
+        self.start_time = time.perf_counter()
+        self.attempts = 0             # HTTP requests sent for this call, counted by the hooks. More than 1 means the client retried
+        self.is_retry = False         # True if this call retries an earlier failed call, for scripts that do their own retrying
+        self.time_to_first_byte = None
+        self.bytes_sent = 0
+        self.bytes_received = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.error = None
+
+    # Called by the HTTP hooks for every request sent, including the client's own retries
+    def on_request(self, request):
+        self.attempts += 1
+        try:
+            self.bytes_sent += len(request.content)
+        except Exception:
+            pass  # Streamed request bodies have no length up front
+
+    # Called by the HTTP hooks as soon as the response headers arrive, before the body is read
+    def on_response(self, response):
+        self.time_to_first_byte = time.perf_counter() - self.start_time
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit():
+            self.bytes_received = int(content_length)
+
+    # Takes the token counts from an API response's 'usage', if it has one
+    def set_usage(self, usage):
+        if usage is not None:
+            self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+            self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+# Measures one API call made inside the 'with' block. Exceptions are recorded by type and then passed on
+@contextmanager
+def measure_call(operation, model=None):
+    call = CallMetrics(operation, model)
+    token = current_call.set(call)
+    try:
+        yield call
+    except BaseException as e:
+        call.error = type(e).__name__
+        raise
+    finally:
+        current_call.reset(token)
+        finish_call(call)
+
+def finish_call(call):
+    if not metrics_enabled:
+        return
+    record = {
+        "time": datetime.datetime.now().isoformat(timespec='milliseconds'),
+        "script": metrics_state["script"] or os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python",
+        "operation": call.operation,
+        "model": call.model,
+        "wall_time": round(time.perf_counter() - call.start_time, 4),
+        "time_to_first_byte": round(call.time_to_first_byte, 4) if call.time_to_first_byte is not None else None,
+        "retries": max(0, call.attempts - 1) + (1 if call.is_retry else 0),  # Each retried call counts once, so totals add up correctly
+        "bytes_sent": call.bytes_sent,
+        "bytes_received": call.bytes_received,
+        "prompt_tokens": call.prompt_tokens,
+        "completion_tokens": call.completion_tokens,
+        "error": call.error,
+    }
+    with records_lock:
+        call_records.append(record)
+        if not metrics_state["exit_handler_registered"]:
+            metrics_state["exit_handler_registered"] = True
+            atexit.register(report_metrics)
+
+# Returns the event hooks that connect an httpx client to the call being measured. Used by the clients made in Common.py
+def get_http_event_hooks(is_async=False):
+    def on_request(request):
+        call = current_call.get()
+        if call is not None:
+            call.on_request(request)
+
+    def on_response(response):
+        call = current_call.get()
+        if call is not None:
+            call.on_response(response)
+
+    if not is_async:
+        return {"request": [on_request], "response": [on_response]}
+
+    async def on_request_async(request):
+        on_request(request)
+
+    async def on_response_async(response):
+        on_response(response)
+
+    return {"request": [on_request_async], "response": [on_response_async]}
+
+# ------------------------------------------------------------- Reports ----------------------------------------------------------------
+
+# Percentile with linear interpolation between the closest values
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+# Groups the records by script and operation
+def group_records(records):
+    groups = {}
+    for record in records:
+        groups.setdefault((record["script"], record["operation"]), []).append(record)
+    return groups
+
+# Printed to stderr, so the report never ends up in the output when a script writes its results to stdout
+def print_metrics_summary(records):
+    print(f"\nAPI call timings in seconds ({len(records)} call(s)):\n", file=sys.stderr)
+    print(f"  {'Operation':<28} {'Calls':>6} {'Errors':>6} {'Retries':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'TTFB p50':>8} {'Received':>10} {'Tokens':>8}", file=sys.stderr)
+    for (script, operation), group in sorted(group_records(records).items()):
+        wall_times = sorted(record["wall_time"] for record in group if record["error"] is None)
+        first_byte_times = sorted(record["time_to_first_byte"] for record in group if record["time_to_first_byte"] is not None)
+        errors = sum(1 for record in group if record["error"] is not None)
+        retries = sum(record["retries"] for record in group)
+        received_kb = sum(record["bytes_received"] or 0 for record in group) / 1024
+        tokens = sum((record["prompt_tokens"] or 0) + (record["completion_tokens"] or 0) for record in group)
+        timings = [percentile(wall_times, fraction) for fraction in (0.5, 0.95, 0.99)] + [percentile(first_byte_times, 0.5)]
+        timing_text = " ".join(f"{value:>7.2f}" if value is not None else f"{'-':>7}" for value in timings[:3])
+        first_byte_text = f"{timings[3]:>8.2f}" if timings[3] is not None else f"{'-':>8}"
+        print(f"  {operation:<28} {len(group):>6} {errors:>6} {retries:>7} {timing_text} {first_byte_text} {received_kb:>8.0f}KB {tokens:>8}", file=sys.stderr)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Formats the records in the Prometheus text exposition format
+def format_prometheus(records):
+    lines = []
+    groups = group_records(records)
+
+    def labels(script, operation, **extra):
+        label_pairs = {"script": script, "operation": operation, **extra}
+        return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in label_pairs.items()) + "}"
+
+    for metric_name, field, help_text in [("api_call_duration_seconds", "wall_time", "Wall time of successful API calls"),
+                                          ("api_call_time_to_first_byte_seconds", "time_to_first_byte", "Time until the response headers arrived")]:
+        lines.append(f"# HELP {metric_name} {help_text}")
+        lines.append(f"# TYPE {metric_name} summary")
+        for (script, operation), group in sorted(groups.items()):
+            values = sorted(record[field] for record in group if record[field] is not None and (field != "wall_time" or record["error"] is None))
+            for fraction in (0.5, 0.95, 0.99):
+                quantile_value = percentile(values, fraction)
+                lines.append(f"{metric_name}{labels(script, operation, quantile=fraction)} {quantile_value if quantile_value is not None else 'NaN'}")
+            lines.append(f"{metric_name}_sum{labels(script, operation)} {sum(values)}")
+            lines.append(f"{metric_name}_count{labels(script, operation)} {len(values)}")
+
+    def add_counter(metric_name, help_text, get_samples):
+        lines.append(f"# HELP {metric_name} {help_text}")
+        lines.append(f"# TYPE {metric_name} counter")
+        for (script, operation), group in sorted(groups.items()):
+            for extra_labels, value in get_samples(group):
+                lines.append(f"{metric_name}{labels(script, operation, **extra_labels)} {value}")
+
+    def count_errors(group):
+        error_counts = {}
+        for record in group:
+            if record["error"] is not None:
+                error_counts[record["error"]] = error_counts.get(record["error"], 0) + 1
+        return [({"error": error}, count) for error, count in sorted(error_counts.items())]
+
+    add_counter("api_calls_total", "API calls made", lambda group: [({}, len(group))])
+    add_counter("api_call_errors_total", "API calls that failed, by error type", count_errors)
+    add_counter("api_call_retries_total", "Retried requests", lambda group: [({}, sum(record["retries"] for record in group))])
+    add_counter("api_call_bytes_total", "Request and response body bytes", lambda group: [
+        ({"direction": "sent"}, sum(record["bytes_sent"] or 0 for record in group)),
+        ({"direction": "received"}, sum(record["bytes_received"] or 0 for record in group))])
+    add_counter("api_call_tokens_total", "Tokens used", lambda group: [
+        ({"type": "prompt"}, sum(record["prompt_tokens"] or 0 for record in group)),
+        ({"type": "completion"}, sum(record["completion_tokens"] or 0 for record in group))])
+    return "\n".join(lines) + "\n"
+
+# Runs at exit: prints the summary and saves the files
+def report_metrics():
+    with records_lock:
+        records = list(call_records)
+    if not records:
+        return
+    if print_summary_at_exit:
+        print_metrics_summary(records)
+    if not (save_jsonl or save_prometheus):
+        return
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    base_path = os.path.join(metrics_dir, f"{records[0]['script']}_{timestamp}_{os.getpid()}")
+    if save_jsonl:
+        with open(base_path + ".jsonl", "w", encoding="utf-8") as jsonl_file:
+            for record in records:
+                jsonl_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if save_prometheus:
+        with open(base_path + ".prom", "w", encoding="utf-8") as prometheus_file:
+            prometheus_file.write(format_prometheus(records))
+    print(f"\nAPI call metrics saved to {base_path}.*", file=sys.stderr)
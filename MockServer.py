@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# A local stand-in for the OpenAI API, for trying out and benchmarking the scripts without using any real API quota.
+# Answers chat completions (normal and streaming), image generations, text to speech and the model list with made up results.
+# Latency, rate limit errors (429) and server errors (500) can be added to see how the scripts handle them.
+# Usage:  python MockServer.py [--port 8765] [--latency-ms 200] [--rate-limit-rate 0.1] [--failure-rate 0.05]
+# Then set base_url = "http://127.0.0.1:8765/v1" in the USER SETTINGS of Chat.py, Dalle.py or TTS.py
+
+# ======================================================================================================================================
+# ========================================================= USER SETTINGS ==============================================================
+# ======================================================================================================================================
+
+default_port = 8765
+latency_ms = 200                # How long each request waits before it's answered
+latency_jitter_ms = 0           # Random extra wait of up to this much, so not every request takes exactly the same time
+rate_limit_rate = 0.0           # Fraction of requests answered with a 429 rate limit error, from 0 to 1
+retry_after_seconds = 1         # Sent in the 'retry-after' header of rate limit errors
+failure_rate = 0.0              # Fraction of requests answered with a 500 server error, from 0 to 1
+random_seed = None              # Set to a number to get the same errors in the same order every run
+
+# Chat completions
+reply_words = 50                # Length of each reply
+stream_chunk_words = 1          # Words in each streamed chunk
+stream_chunk_delay_ms = 20      # Wait between streamed chunks, like a model generating tokens
+
+# Images
+image_size = None               # (width, height) of the returned image, such as (256, 256). None to use the size that was requested
+image_color = (120, 180, 240)
+
+# Text to speech
+audio_bytes_per_char = 1000     # Size of the returned audio. Roughly what mp3 speech takes per character of text
+audio_chunk_bytes = 16384       # Audio is sent in pieces of this size, so streaming can be measured
+audio_chunk_delay_ms = 0        # Wait between pieces of audio
+
+model_names = ["gpt-4", "gpt-4o", "gpt-4o-mini", "gpt-3.5-turbo", "dall-e-2", "dall-e-3", "tts-1", "tts-1-hd"]
+
+# ======================================================================================================================================
+# ======================================================================================================================================
+# ======================================================================================================================================
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import multiprocessing
+import random
+import socket
+import time
+import wave
+
+# Collects the settings above into one dictionary, with any overrides, so a server can be started with different settings from another script
+def get_mock_config(**overrides):
+    config = {
+        "latency_ms": latency_ms,
+        "latency_jitter_ms": latency_jitter_ms,
+        "rate_limit_rate": rate_limit_rate,
+        "retry_after_seconds": retry_after_seconds,
+        "failure_rate": failure_rate,
+        "random_seed": random_seed,
+        "reply_words": reply_words,
+        "stream_chunk_words": stream_chunk_words,
+        "stream_chunk_delay_ms": stream_chunk_delay_ms,
+        "image_size": image_size,
+        "image_color": image_color,
+        "audio_bytes_per_char": audio_bytes_per_char,
+        "audio_chunk_bytes": audio_chunk_bytes,
+        "audio_chunk_delay_ms": audio_chunk_delay_ms,
+        "model_names": model_names,
+    }
+    unknown_settings = set(overrides) - set(config)
+    if unknown_settings:
+        raise ValueError(f"Unknown mock server setting(s): {', '.join(sorted(unknown_settings))}")
+    config.update(overrides)
+    return config
+
+# Rough token count, about how many tokens English text has per word
+def estimate_tokens(text):
+    return max(1, round(len(text.split()) * 1.3))
+
+def create_png_b64(size, color):
+    buffer = io.BytesIO()
+    from PIL import Image
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+# Returns audio of the requested format. WAV gets a real header so it can be opened and joined, other formats are just filler bytes
+def create_audio(byte_count, audio_format):
+    if audio_format != "wav":
+        return bytes(byte_count)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(24000)
+        wav_file.writeframes(bytes(byte_count - byte_count % 2))
+    return buffer.getvalue()
+
+def create_mock_app(config):
+    from aiohttp import web
+
+    rng = random.Random(config["random_seed"])
+    png_cache = {}
+    request_counts = {}
+
+    def error_response(status, message, error_type, headers=None):
+        return web.json_response({"error": {"message": message, "type": error_type, "param": None, "code": None}}, status=status, headers=headers)
+
+    # Waits the configured latency, then decides whether this request fails. Returns the error response to send, or None to answer normally
+    async def simulate(endpoint):
+        request_counts[endpoint] = request_counts.get(endpoint, 0) + 1
+        await asyncio.sleep((config["latency_ms"] + rng.uniform(0, config["latency_jitter_ms"])) / 1000)
+        roll = rng.random()
+        if roll < config["rate_limit_rate"]:
+            return error_response(429, "Rate limit reached (mock server)", "requests",
+                                  headers={"retry-after": str(config["retry_after_seconds"])})
+        if roll < config["rate_limit_rate"] + config["failure_rate"]:
+            return error_response(500, "The server had an error while processing your request (mock server)", "server_error")
+        return None
+
+    def make_reply(request_messages):
+        last_message = str(request_messages[-1].get("content", "")) if request_messages else ""
+        words = (f"Mock reply to: {last_message[:80]}".split() + ["lorem", "ipsum", "dolor", "sit", "amet"] * config["reply_words"])
+        return " ".join(words[:max(config["reply_words"], 1)])
+
+    async def chat_completions(request):
+        body = await request.json()
+        error = await simulate("chat.completions")
+        if error:
+            return error
+        reply = make_reply(body.get("messages", []))
+        prompt_tokens = sum(estimate_tokens(str(message.get("content", ""))) for message in body.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(reply),
+                 "total_tokens": prompt_tokens + estimate_tokens(reply)}
+        completion_id = f"chatcmpl-mock{request_counts['chat.completions']}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            return web.json_response({"id": completion_id, "object": "chat.completion", "created": created, "model": body["model"],
+                                      "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                                      "usage": usage})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send_chunk(choices, chunk_usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"], "choices": choices}
+            if chunk_usage:
+                chunk["usage"] = chunk_usage
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        words = reply.split(" ")
+        step = max(config["stream_chunk_words"], 1)
+        for i in range(0, len(words), step):
+            delta = {"content": (" " if i else "") + " ".join(words[i:i + step])}
+            if i == 0:
+                delta["role"] = "assistant"
+            await send_chunk([{"index": 0, "delta": delta, "finish_reason": None}])
+            if config["stream_chunk_delay_ms"]:
+                await asyncio.sleep(config["stream_chunk_delay_ms"] / 1000)
+        await send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send_chunk([], usage)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def images_generations(request):
+        body = await request.json()
+        error = await simulate("images.generate")
+        if error:
+            return error
+        size = config["image_size"] or tuple(int(side) for side in body.get("size", "1024x1024").split("x"))
+        if size not in png_cache:
+            png_cache[size] = create_png_b64(size, config["image_color"])
+        image_data = [{"b64_json": png_cache[size], "revised_prompt": f"Mock revised prompt: {body['prompt']}"} for _ in range(body.get("n") or 1)]
+        return web.json_response({"created": int(time.time()), "data": image_data})
+
+    async def audio_speech(request):
+        body = await request.json()
+        error = await simulate("audio.speech")
+        if error:
+            return error
+        audio_data = create_audio(len(body["input"]) * config["audio_bytes_per_char"], body.get("response_format", "mp3"))
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        response.content_length = len(audio_data)
+        await response.prepare(request)
+        for start in range(0, len(audio_data), config["audio_chunk_bytes"]):
+            await response.write(audio_data[start:start + config["audio_chunk_bytes"]])
+            if config["audio_chunk_delay_ms"]:
+                await asyncio.sleep(config["audio_chunk_delay_ms"] / 1000)
+        return response
+
+    async def models_list(request):
+        return web.json_response({"object": "list", "data": [{"id": name, "object": "model", "created": 1700000000, "owned_by": "mock"}
+                                                             for name in config["model_names"]]})
+
+    # Number of requests received by each endpoint, including ones answered with an error
+    async def mock_stats(request):
+        return web.json_response(request_counts)
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/images/generations", images_generations)
+    app.router.add_post("/v1/audio/speech", audio_speech)
+    app.router.add_get("/v1/models", models_list)
+    app.router.add_get("/mock/stats", mock_stats)
+    return app
+
+def run_mock_server(port, config, quiet=True):
+    from aiohttp import web
+    web.run_app(create_mock_app(config), host="127.0.0.1", port=port, backlog=4096, access_log=None, print=None if quiet else print)
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Starts a mock server in its own process, so it doesn't compete with the code being measured. Settings can be overridden by name.
+# Returns the process and the base URL to send requests to. Stop it with process.terminate()
+def start_mock_server(**overrides):
+    config = get_mock_config(**overrides)
+    port = get_free_port()
+    server_process = multiprocessing.Process(target=run_mock_server, args=(port, config), daemon=True)
+    server_process.start()
+
+    # Wait until the server accepts connections
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if not server_process.is_alive():
+                raise RuntimeError("The mock server failed to start")
+            time.sleep(0.05)
+    return server_process, f"http://127.0.0.1:{port}/v1"
+
+# --------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI API for testing the scripts offline.")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--latency-ms", type=int, default=latency_ms, help="How long each request waits before it's answered")
+    parser.add_argument("--jitter-ms", type=int, default=latency_jitter_ms, help="Random extra wait of up to this much")
+    parser.add_argument("--rate-limit-rate", type=float, default=rate_limit_rate, help="Fraction of requests answered with a 429 error")
+    parser.add_argument("--failure-rate", type=float, default=failure_rate, help="Fraction of requests answered with a 500 error")
+    parser.add_argument("--seed", type=int, default=random_seed, help="Random seed, to get the same errors every run")
+    args = parser.parse_args()
+
+    server_config = get_mock_config(latency_ms=args.latency_ms, latency_jitter_ms=args.jitter_ms, rate_limit_rate=args.rate_limit_rate,
+                                    failure_rate=args.failure_rate, random_seed=args.seed)
+    print(f"Mock API server running. Set base_url = \"http://127.0.0.1:{args.port}/v1\" in the script's settings. Press Ctrl+C to stop.")
+    print(f"Latency {args.latency_ms} ms (+ up to {args.jitter_ms} ms), {args.rate_limit_rate:.0%} rate limit errors, {args.failure_rate:.0%} server errors")
+    run_mock_server(args.port, server_config)
@@ -12,57 +12,520 @@ voice = "alloy"         # alloy, echo, fable, onyx, nova, shimmer
 text = "This is what I'm going to say!"
 
 # Advanced settings
-format = "mp3"          # "mp3", "opus", "aac", "flac"
+format = "mp3"          # "mp3", "opus", "aac", "flac", "wav", "pcm"
 speed = 1.0             # 0.25 to 4.0
 
 # Speech file base name - numbers will be appended to this for each file added
 outputFolder = "TTS-Outputs"
 speech_file_base_name = f"speech_{voice}"  # Example: speech_tts-1-hd_alloy
 
+# Long text - Text longer than max_chunk_chars is split into pieces at sentence and paragraph breaks. The pieces are generated
+# at the same time and then joined back together into one file
+text_file = None            # Path to a text file to read the text from instead, such as a long document. None to use 'text' above
+max_chunk_chars = 4000      # The API allows up to 4096 characters per request
+max_concurrent_chunks = 4   # How many pieces are generated at the same time
+
+# Streaming - Saves the audio as it arrives instead of waiting for the whole file, and can play it while it's still being generated
+stream_audio = True         # True | False
+playback = None             # None | "player" (plays the audio with player_command) | "stdout" (writes the audio to standard output for piping into another program)
+player_command = ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-"]  # Any player that can read audio from standard input
+stream_chunk_size = 16384   # Bytes read at a time while streaming
+
+# Audio cache - Text already generated with the same model, voice, format and speed is reused from the cache instead of being generated again.
+# Long texts are cached part by part (up to max_chunk_chars each), so a document generated again only needs its changed parts. A part is only
+# reused when it is identical, so a sentence or paragraph repeated inside one document is still generated each time it appears
+use_audio_cache = True
+audio_cache_dir = "TTS-Cache"
+audio_cache_max_size_mb = 500   # Least recently used audio is deleted once the cache grows past this size
+
+# Batch mode - Generates many files from a manifest. Run with:  python TTS.py --manifest jobs.csv   (or jobs.jsonl)
+# Each row has 'text' and optionally 'voice', 'model', 'speed', 'format' and 'output' (file name). Missing values use the settings above.
+# Finished rows are recorded in a journal file next to the manifest, so running the same manifest again skips them
+# Existing files are never overwritten. If a row's output name is already taken, a number is added to it (name_2, name_3...)
+batch_concurrency = 8       # How many rows are generated at the same time
+requests_per_minute = 50    # Requests are spaced out to stay within this rate limit
+
+# Optional custom API address, such as a local test server. Leave as None to use the normal OpenAI API
+base_url = None
+
 # ======================================================================================================================================
 # ======================================================================================================================================
 # ======================================================================================================================================
 
-from openai import OpenAI
 import os
+import re
+import asyncio
+import shutil
+import subprocess
+import tempfile
+import wave
+import hashlib
+import json
+import sys
+import time
+import csv
+import argparse
+from Common import create_numbered_file, create_unique_file, remove_if_empty, check_model_name, print_unknown_model_error, configure_api, get_client, create_async_client
+from Common import track_cache_file
+from Metrics import measure_call, set_script_name
+
+configure_api(base_url=base_url)  # The client itself is only created when first needed, see Common.py
+set_script_name("tts")  # Label for the API call timings recorded by Metrics.py
+
+# Formats where audio files can simply be joined end to end and still play correctly.
+# (Opus files become a 'chained' Ogg stream, which is part of the Ogg standard and supported by most players)
+concatenable_formats = ["mp3", "aac", "opus", "pcm"]
+
+# Splits text into pieces of at most max_chars characters, breaking between paragraphs or sentences where possible
+def split_text(text, max_chars):
+    pieces = []  # List of (piece text, separator to put before it when joining)
+    for paragraph in re.split(r'\n\s*\n', text.strip()):
+        separator = "\n\n"
+        # Break long paragraphs into sentences. Very long sentences are broken at spaces as a last resort
+        sentences = [paragraph] if len(paragraph) <= max_chars else re.split(r'(?<=[.!?])\s+', paragraph)
+        for sentence in sentences:
+            while len(sentence) > max_chars:
+                split_at = sentence.rfind(' ', 0, max_chars)
+                if split_at <= 0:
+                    split_at = max_chars
+                pieces.append((sentence[:split_at], separator))
+                sentence = sentence[split_at:].lstrip()
+                separator = " "
+            if sentence.strip():
+                pieces.append((sentence, separator))
+            separator = " "
 
-# Load API key from key.txt file
-def load_api_key(filename="key.txt"):
+    # Join neighbouring pieces back together as long as they fit, so there are as few requests as possible
+    chunks = []
+    for piece, separator in pieces:
+        if chunks and len(chunks[-1]) + len(separator) + len(piece) <= max_chars:
+            chunks[-1] = chunks[-1] + separator + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+# The settings that affect the generated audio. Batch rows can override any of them
+def get_speech_settings(**overrides):
+    settings = {"model": model, "voice": voice, "format": format, "speed": speed}
+    settings.update({key: value for key, value in overrides.items() if value not in (None, "")})
+    settings["speed"] = float(settings["speed"])
+    return settings
+
+# ------------------------------------------------ Audio Cache -------------------------------------------------
+
+# Creates a hash of everything that affects the generated audio. Whitespace differences don't change the speech, so they are ignored
+def get_audio_cache_key(speech_text, settings):
+    normalized_text = " ".join(speech_text.split())
+    key_data = json.dumps([settings["model"], settings["voice"], settings["format"], float(settings["speed"]), normalized_text], ensure_ascii=False)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+def get_audio_cache_path(cache_key, audio_format):
+    # Files are split into sub-folders by the first two characters of the hash to keep folders small
+    return os.path.join(audio_cache_dir, cache_key[:2], f"{cache_key}.{audio_format}")
+
+# Returns the path of the cached audio for this key, or None if there isn't any
+def load_cached_audio(cache_key, audio_format):
+    if not use_audio_cache:
+        return None
+    cache_path = get_audio_cache_path(cache_key, audio_format)
     try:
-        with open(filename, "r", encoding='utf-8') as key_file:
-            for line in key_file:
-                stripped_line = line.strip()
-                if not stripped_line.startswith('#') and stripped_line != '':
-                    api_key = stripped_line
-                    break
-        return api_key
+        os.utime(cache_path)  # Marks it as recently used, for deciding what to evict
     except FileNotFoundError:
-        print("\nAPI key file not found. Please create a file named 'key.txt' in the same directory as this script and paste your API key in it.\n")
-        exit()
-
-# This creates the authenticated OpenAI client object that we can use to send requests
-client = OpenAI(api_key=load_api_key())  # Retrieves key from key.txt file  
-
-# This sends the API Request
-response = client.audio.speech.create(
-  model=model,
-  voice=voice,
-  input=text,
-  response_format=format,
-  speed=speed
-)
-
-# Create outputFolder
-if not os.path.exists(outputFolder):
-    os.makedirs(outputFolder)
-
-# Determine file name by finding the next available number out of files in the outputFolder. Starting with no number then starting at 2
-file_name = f"{speech_file_base_name}.{format}"
-file_number = 2
-while os.path.exists(os.path.join(outputFolder, file_name)):
-    file_name = f"{speech_file_base_name}_{file_number}.{format}"
-    file_number += 1
-    
-# Save the audio to a file
-filePath = os.path.join(outputFolder, file_name)
-response.stream_to_file(filePath)
\ No newline at end of file
+        return None
+    return cache_path
+
+# Adds audio to the cache, either from bytes or by copying an existing file
+def store_cached_audio(cache_key, audio_format, audio_data=None, source_path=None):
+    if not use_audio_cache:
+        return
+    cache_path = get_audio_cache_path(cache_key, audio_format)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Write to a temporary file first, so a crash can never leave half a file in the cache
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    if source_path:
+        shutil.copyfile(source_path, temp_path)
+    else:
+        with open(temp_path, "wb") as cache_file:
+            cache_file.write(audio_data)
+    os.replace(temp_path, cache_path)
+    track_cache_file(audio_cache_dir, cache_path, audio_cache_max_size_mb * 1024 * 1024)
+
+# Copies cached audio to the output file, also sending it to the player if playback is on
+def copy_cached_audio(cache_path, file_path):
+    playback_stream = open_playback()
+    with open(cache_path, "rb") as cache_file, open(file_path, "wb") as output_file:
+        while audio_data := cache_file.read(stream_chunk_size):
+            output_file.write(audio_data)
+            playback_stream = write_playback(playback_stream, audio_data)
+    close_playback(playback_stream)
+
+# --------------------------------------------------------------------------------------------------------------
+
+# Status messages go to stderr when the audio itself is being written to stdout, so they don't end up mixed into the audio
+def print_status(message):
+    print(message, file=sys.stderr if playback == "stdout" else sys.stdout, flush=True)
+
+# Starts the audio player if playback is turned on. Returns a writable binary stream, or None
+def open_playback():
+    if playback == "stdout":
+        return sys.stdout.buffer
+    if playback == "player":
+        try:
+            return subprocess.Popen(player_command, stdin=subprocess.PIPE).stdin
+        except FileNotFoundError:
+            print_status(f"\nWARNING: Audio player '{player_command[0]}' was not found. Continuing without playback.")
+    return None
+
+# Sends audio data to the player. Returns the player again, or None if it was closed (for example, the player window was closed)
+def write_playback(playback_stream, audio_data):
+    if playback_stream is None:
+        return None
+    try:
+        playback_stream.write(audio_data)
+        playback_stream.flush()
+        return playback_stream
+    except (BrokenPipeError, OSError):
+        return None
+
+def close_playback(playback_stream):
+    if playback_stream is not None and playback_stream is not sys.stdout.buffer:
+        try:
+            playback_stream.close()  # Lets the player know the audio has ended, so it exits once it finishes playing
+        except (BrokenPipeError, OSError):
+            pass
+
+# Streams the audio into the file piece by piece as it is generated, so memory use stays the same no matter how long the audio is
+def stream_speech_to_file(speech_text, file_path):
+    start_time = time.perf_counter()
+    time_to_first_audio = None
+    total_bytes = 0
+    playback_stream = open_playback()
+
+    with measure_call("audio.speech (stream)", model) as call, get_client().audio.speech.with_streaming_response.create(
+        model=model,
+        voice=voice,
+        input=speech_text,
+        response_format=format,
+        speed=speed
+    ) as response:
+        with open(file_path, "wb") as output_file:
+            for audio_data in response.iter_bytes(stream_chunk_size):
+                if time_to_first_audio is None:
+                    time_to_first_audio = time.perf_counter() - start_time
+                output_file.write(audio_data)
+                playback_stream = write_playback(playback_stream, audio_data)
+                total_bytes += len(audio_data)
+        call.bytes_received = total_bytes
+
+    close_playback(playback_stream)
+    total_time = time.perf_counter() - start_time
+    print_status(f"\n[Time to first audio: {time_to_first_audio or total_time:.2f}s | Total time: {total_time:.2f}s | {total_bytes / 1024:.1f} KB]")
+
+# Spaces out requests so they stay within a requests per minute limit
+class RateLimiter:
+    def __init__(self, requests_per_minute):
+        self.interval = 60 / requests_per_minute
+        self.next_request_time = 0
+
+    async def wait(self):
+        now = time.monotonic()
+        request_time = max(now, self.next_request_time)
+        self.next_request_time = request_time + self.interval
+        if request_time > now:
+            await asyncio.sleep(request_time - now)
+
+# Generates the audio for every chunk, a few at a time. Returns the audio data for each chunk in the original order.
+# If given, on_chunk_ready is called with each chunk's audio in order as soon as it and all chunks before it are done, such as for playback.
+# A shared client and rate limiter can be passed in, as batch mode does
+async def synthesize_chunks(chunks, settings, on_chunk_ready=None, async_client=None, rate_limiter=None, show_progress=True):
+    owns_client = async_client is None
+    if owns_client:
+        async_client = create_async_client(concurrency=max_concurrent_chunks)
+    semaphore = asyncio.Semaphore(max_concurrent_chunks)
+    finished_count = [0]
+
+    async def synthesize_chunk(chunk, cache_key):
+        cache_path = load_cached_audio(cache_key, settings["format"])
+        if cache_path:
+            finished_count[0] += 1
+            if show_progress:
+                print_status(f"  Part {finished_count[0]} of {len(chunks)} found in cache")
+            with open(cache_path, "rb") as cache_file:
+                return cache_file.read()
+        async with semaphore:
+            if rate_limiter:
+                await rate_limiter.wait()
+            with measure_call("audio.speech", settings["model"]) as call:
+                response = await async_client.audio.speech.create(
+                    model=settings["model"],
+                    voice=settings["voice"],
+                    input=chunk,
+                    response_format=settings["format"],
+                    speed=settings["speed"]
+                )
+                call.bytes_received = len(response.content)
+            finished_count[0] += 1
+            if show_progress:
+                print_status(f"  Generated part {finished_count[0]} of {len(chunks)}")
+            store_cached_audio(cache_key, settings["format"], audio_data=response.content)
+            return response.content
+
+    # Identical chunks share one task, so a whole chunk that appears more than once is only generated once
+    tasks_by_key = {}
+    tasks = []
+    try:
+        for chunk in chunks:
+            cache_key = get_audio_cache_key(chunk, settings)
+            if cache_key not in tasks_by_key:
+                tasks_by_key[cache_key] = asyncio.create_task(synthesize_chunk(chunk, cache_key))
+            tasks.append(tasks_by_key[cache_key])
+        chunk_audio_list = []
+        for task in tasks:
+            chunk_audio_list.append(await task)
+            if on_chunk_ready:
+                on_chunk_ready(chunk_audio_list[-1])
+        return chunk_audio_list
+    finally:
+        for task in tasks:
+            task.cancel()
+        if owns_client:
+            await async_client.close()
+
+# Joins the audio for each chunk into one file, without re-encoding the audio
+def join_audio_chunks(chunk_audio_list, file_path, audio_format):
+    # A single chunk needs no joining in any format, such as a short manifest row
+    if audio_format in concatenable_formats or len(chunk_audio_list) == 1:
+        with open(file_path, "wb") as output_file:
+            for chunk_audio in chunk_audio_list:
+                output_file.write(chunk_audio)
+        return file_path
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        part_paths = []
+        for i, chunk_audio in enumerate(chunk_audio_list):
+            part_paths.append(os.path.join(temp_dir, f"part_{i}.{audio_format}"))
+            with open(part_paths[-1], "wb") as part_file:
+                part_file.write(chunk_audio)
+
+        if audio_format == "wav":
+            # WAV files have a header, so copy the audio frames of each part into a single new file
+            with wave.open(file_path, "wb") as output_file:
+                for i, part_path in enumerate(part_paths):
+                    with wave.open(part_path, "rb") as part_file:
+                        if i == 0:
+                            output_file.setparams(part_file.getparams())
+                        output_file.writeframes(part_file.readframes(part_file.getnframes()))
+            return file_path
+
+        # FLAC can't be joined directly, but ffmpeg can join the parts without re-encoding if it's installed
+        if shutil.which("ffmpeg"):
+            list_path = os.path.join(temp_dir, "parts.txt")
+            with open(list_path, "w", encoding="utf-8") as list_file:
+                for part_path in part_paths:
+                    list_file.write(f"file '{part_path}'\n")
+            subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", file_path], check=True)
+            return file_path
+
+        # Otherwise save each part as its own numbered file next to where the full file would have gone
+        print_status(f"\nWARNING: Joining {audio_format} files requires ffmpeg, which was not found. Saving each part separately instead.")
+        base_path, extension = os.path.splitext(file_path)
+        for i, part_path in enumerate(part_paths):
+            shutil.copyfile(part_path, f"{base_path}_part{i + 1}{extension}")
+        remove_if_empty(file_path)  # The name may have been reserved with an empty file, which would otherwise be left behind
+        return f"{base_path}_part1{extension}"
+
+# Determine file name using the next number from the outputFolder's counter file. Starting with no number then starting at 2
+def get_output_path():
+    def make_name(file_number):
+        if file_number == 1:
+            return f"{speech_file_base_name}.{format}"
+        return f"{speech_file_base_name}_{file_number}.{format}"
+    # Files from before the counter existed are found with a one-time scan of the folder
+    existing_pattern = re.escape(speech_file_base_name) + r"(?:_(\d+))?" + re.escape(f".{format}")
+    return create_numbered_file(outputFolder, f"{speech_file_base_name}.{format}", make_name, existing_pattern)
+
+# Exits with an error if any of the model names isn't available to the account, before any requests are sent
+def validate_models(modelNames):
+    for modelName in modelNames:
+        is_known, similar_names = check_model_name(get_client(), modelName)
+        if not is_known:
+            print_unknown_model_error(modelName, similar_names)
+            exit()
+
+# -------------------------------------------------- Batch Mode --------------------------------------------------
+
+# Reads the rows of a CSV or JSONL manifest as dictionaries
+def read_manifest(manifest_path):
+    with open(manifest_path, "r", encoding="utf-8", newline="") as manifest_file:
+        if manifest_path.lower().endswith(".csv"):
+            return list(csv.DictReader(manifest_file))
+        return [json.loads(line) for line in manifest_file if line.strip()]
+
+# Creates a hash of a row's number and contents, so a row that was edited or moved since an earlier run is generated again
+def get_row_key(row_number, row):
+    key_data = json.dumps([row_number, row], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+# Returns the keys (see get_row_key) of the rows already finished by earlier runs of this manifest
+def read_journal(journal_path):
+    finished_rows = set()
+    if os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    finished_rows.add(json.loads(line)["key"])
+                except (json.decoder.JSONDecodeError, KeyError):
+                    pass  # A line cut off by a crash, that row will simply be done again
+    return finished_rows
+
+# Returns the output file name of a row. Rows without an 'output' are named after the manifest and row number
+def get_output_name(row_number, row, manifest_name):
+    file_name = row.get("output") or f"{manifest_name}_{row_number}"
+    if not os.path.splitext(file_name)[1]:
+        file_name = f"{file_name}.{row.get('format') or format}"
+    return file_name
+
+# Generates one manifest row, using the cache and splitting long text the same way as a normal run
+async def synthesize_row(row, file_path, async_client, rate_limiter):
+    settings = get_speech_settings(model=row.get("model"), voice=row.get("voice"), format=row.get("format"), speed=row.get("speed"))
+    row_text = row["text"]
+    if len(row_text) > max_chunk_chars:
+        chunks = split_text(row_text, max_chunk_chars)
+    else:
+        chunks = [row_text]
+    chunk_audio_list = await synthesize_chunks(chunks, settings, async_client=async_client, rate_limiter=rate_limiter, show_progress=False)
+    return join_audio_chunks(chunk_audio_list, file_path, settings["format"])
+
+async def run_manifest(manifest_path, concurrency):
+    rows = read_manifest(manifest_path)
+    validate_models({row.get("model") or model for row in rows})
+    journal_path = manifest_path + ".journal"
+    finished_rows = read_journal(journal_path)
+    manifest_name = os.path.splitext(os.path.basename(manifest_path))[0]
+    os.makedirs(outputFolder, exist_ok=True)
+
+    # One client with a pool of keep-alive connections is shared by every request
+    async_client = create_async_client(concurrency=concurrency)
+    rate_limiter = RateLimiter(requests_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"files": 0, "chars": 0, "failed": 0}
+
+    async def run_row(row_number, row, row_key, journal_file):
+        async with semaphore:
+            # Reserve the name first, so a file from an earlier run or another row with the same output name is never overwritten
+            file_name = get_output_name(row_number, row, manifest_name)
+            reserved_path = create_unique_file(outputFolder, file_name)
+            if os.path.basename(reserved_path) != file_name:
+                print(f"  Row {row_number}: {file_name} already exists, saving as {os.path.basename(reserved_path)} instead")
+            try:
+                file_path = await synthesize_row(row, reserved_path, async_client, rate_limiter)
+            except BaseException as e:
+                remove_if_empty(reserved_path)
+                if not isinstance(e, Exception):
+                    raise  # Interrupted or cancelled
+                stats["failed"] += 1
+                print(f"  Row {row_number} failed: {type(e).__name__}: {e}")
+                return
+        # Record the finished row straight away, so it won't be generated again if the run is interrupted
+        journal_file.write(json.dumps({"row": row_number, "key": row_key, "output": file_path}, ensure_ascii=False) + "\n")
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        stats["files"] += 1
+        stats["chars"] += len(row["text"])
+        print(f"  [{stats['files']}/{len(pending_rows)}] {file_path}")
+
+    row_keys = [get_row_key(row_number, row) for row_number, row in enumerate(rows, start=1)]
+    pending_rows = [(row_number, row, row_key) for row_number, (row, row_key) in enumerate(zip(rows, row_keys), start=1) if row_key not in finished_rows]
+    if len(pending_rows) < len(rows):
+        print(f"\nSkipping {len(rows) - len(pending_rows)} row(s) already finished in an earlier run (see {journal_path})")
+    print(f"\nGenerating {len(pending_rows)} file(s)...")
+
+    start_time = time.perf_counter()
+    try:
+        with open(journal_path, "a", encoding="utf-8") as journal_file:
+            await asyncio.gather(*(run_row(row_number, row, row_key, journal_file) for row_number, row, row_key in pending_rows))
+    finally:
+        await async_client.close()
+    total_time = time.perf_counter() - start_time
+
+    print(f"\nFinished in {total_time:.1f}s: {stats['files']} file(s), {stats['failed']} failure(s)")
+    print(f"  {stats['chars'] / total_time:.0f} characters/sec | {stats['files'] / total_time:.2f} files/sec")
+
+# --------------------------------------------------------------------------------------------------------------
+
+def main():
+    validate_models([model])
+    speech_text = text
+    if text_file:
+        with open(text_file, "r", encoding="utf-8") as input_file:
+            speech_text = input_file.read()
+
+    # Create outputFolder
+    if not os.path.exists(outputFolder):
+        os.makedirs(outputFolder)
+
+    filePath = get_output_path()
+
+    # The output file is created empty to reserve its name, so remove it again if generating the audio fails or is interrupted
+    try:
+        settings = get_speech_settings()
+        cache_key = get_audio_cache_key(speech_text, settings)
+        cache_path = load_cached_audio(cache_key, format)
+        if cache_path:
+            copy_cached_audio(cache_path, filePath)
+            print_status("\n[Cached audio]")
+        elif len(speech_text) <= max_chunk_chars and stream_audio:
+            stream_speech_to_file(speech_text, filePath)
+        elif len(speech_text) <= max_chunk_chars:
+            # This sends the API Request
+            with measure_call("audio.speech", model) as call:
+                response = get_client().audio.speech.create(
+                  model=model,
+                  voice=voice,
+                  input=speech_text,
+                  response_format=format,
+                  speed=speed
+                )
+                call.bytes_received = len(response.content)
+            # Save the audio to a file
+            response.stream_to_file(filePath)
+        else:
+            # Long text - each part is cached separately
+            chunks = split_text(speech_text, max_chunk_chars)
+            print_status(f"\nText is {len(speech_text)} characters long, generating it in {len(chunks)} parts...")
+            start_time = time.perf_counter()
+            timing = {"first_audio": None}
+            playback_stream = [open_playback()]
+
+            # Play each part as soon as it and the parts before it are ready, instead of waiting for the whole document
+            def play_chunk(chunk_audio):
+                if timing["first_audio"] is None:
+                    timing["first_audio"] = time.perf_counter() - start_time
+                playback_stream[0] = write_playback(playback_stream[0], chunk_audio)
+
+            chunk_audio_list = asyncio.run(synthesize_chunks(chunks, settings, on_chunk_ready=play_chunk))
+            close_playback(playback_stream[0])
+            filePath = join_audio_chunks(chunk_audio_list, filePath, format)
+            total_time = time.perf_counter() - start_time
+            print_status(f"\n[Time to first audio: {timing['first_audio']:.2f}s | Total time: {total_time:.2f}s]")
+    except BaseException:
+        remove_if_empty(filePath)
+        raise
+
+    # Cache the complete audio as well, so repeating the same text is a single file copy. Long texts are already cached part by part
+    if not cache_path and len(speech_text) <= max_chunk_chars:
+        store_cached_audio(cache_key, format, source_path=filePath)
+
+    print_status(f"\nSaved audio to {filePath}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate text-to-speech audio files.")
+    parser.add_argument("--manifest", metavar="MANIFEST", help="CSV or JSONL file of texts to generate in one batch")
+    parser.add_argument("--concurrency", type=int, default=batch_concurrency, help="How many manifest rows are generated at the same time")
+    args = parser.parse_args()
+
+    if args.manifest:
+        asyncio.run(run_manifest(args.manifest, args.concurrency))
+    else:
+        main()